@@ -0,0 +1,143 @@
+## The following code is a part of Sensors section at the Carla simulator research blog - https://carlasimblog.wordpress.com/2023/09/16/visualize-multiple-sensors/.
+## Feel free to show your support via requested, suggestions and interesting ideas for future research material.
+
+## Check of spawn_rig against a stub client and world, no simulator needed: the blueprint library is fetched once
+## per world, the whole rig is spawned with one apply_batch_sync in rig order, and when a sensor fails to spawn
+## the others are destroyed again in one more batch and RuntimeError is raised.
+## A minimal stand-in for the few carla classes spawn_rig uses replaces the carla package during the check, so the
+## commands of the batches can be read back, with or without carla installed.
+
+import argparse
+import os
+import sys
+import types
+
+carla = types.ModuleType('carla')
+carla.Location = lambda x=0.0, y=0.0, z=0.0: types.SimpleNamespace(x=x, y=y, z=z)
+carla.Rotation = lambda pitch=0.0, yaw=0.0, roll=0.0: types.SimpleNamespace(pitch=pitch, yaw=yaw, roll=roll)
+carla.Transform = lambda location, rotation: types.SimpleNamespace(location=location, rotation=rotation)
+carla.command = types.SimpleNamespace(
+    SpawnActor=lambda blueprint, transform, parent: ('spawn', blueprint, transform, parent),
+    DestroyActor=lambda actor_id: ('destroy', actor_id))
+sys.modules['carla'] = carla
+
+from sensor_rig import load_rig, spawn_rig
+
+RIG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rigs', 'data_collection.json')
+RESOLUTION = (1280, 720)
+PARENT_ID = 7
+
+
+class StubBlueprint:
+    def __init__(self, type_id):
+        self.id = type_id
+        self.attributes = {'image_size_x': '800', 'image_size_y': '600', 'fov': '90'}
+
+    def has_attribute(self, key):
+        return key in self.attributes
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+
+class StubLibrary:
+    def find(self, type_id):
+        # a new blueprint per find, like carla's library returns a copy
+        return StubBlueprint(type_id)
+
+
+class StubWorld:
+    def __init__(self, world_id):
+        self.id = world_id
+        self.library_fetches = 0
+        self.actors = {}
+
+    def get_blueprint_library(self):
+        self.library_fetches += 1
+        return StubLibrary()
+
+    def get_actors(self, actor_ids):
+        # in a different order than asked, spawn_rig has to put them back in rig order
+        return [self.actors[actor_id] for actor_id in sorted(actor_ids, reverse=True)]
+
+
+class StubClient:
+    def __init__(self, world, failing=()):
+        """Spawns every SpawnActor command in world, except the blueprint types in failing."""
+        self.world = world
+        self.failing = set(failing)
+        self.batches = []
+        self.next_id = 100
+
+    def apply_batch_sync(self, commands, do_tick=False):
+        self.batches.append(commands)
+        responses = []
+        for command in commands:
+            kind, *args = command
+            if kind == 'destroy':
+                self.world.actors.pop(args[0])
+                responses.append(types.SimpleNamespace(actor_id=args[0], error=''))
+            elif args[0].id in self.failing:
+                responses.append(types.SimpleNamespace(actor_id=0, error='spawn failed because of collision'))
+            else:
+                self.next_id += 1
+                blueprint, transform, parent = args
+                self.world.actors[self.next_id] = types.SimpleNamespace(
+                    id=self.next_id, type_id=blueprint.id, attributes=dict(blueprint.attributes),
+                    transform=transform, parent=parent)
+                responses.append(types.SimpleNamespace(actor_id=self.next_id, error=''))
+        return responses
+
+
+def check_spawn(rig):
+    world = StubWorld(1)
+    client = StubClient(world)
+    parent = types.SimpleNamespace(id=PARENT_ID)
+    actors = spawn_rig(client, world, rig, parent, RESOLUTION)
+
+    assert len(client.batches) == 1, 'the rig takes %d batches' % len(client.batches)
+    assert len(client.batches[0]) == len(rig)
+    assert [actor.type_id for actor in actors] == [spec['type'] for spec in rig], 'actors are not in rig order'
+    for actor, spec in zip(actors, rig):
+        width, height = spec['resolution'] or RESOLUTION
+        assert actor.parent == PARENT_ID
+        assert (actor.attributes['image_size_x'], actor.attributes['image_size_y']) == (str(width), str(height))
+        for key, value in spec['attributes'].items():
+            assert actor.attributes[key] == value
+        assert actor.transform.location.x == spec['transform']['x']
+
+    # a second rig in the same world uses the cached library
+    spawn_rig(client, world, rig, parent, RESOLUTION)
+    assert world.library_fetches == 1, 'the library is fetched %d times' % world.library_fetches
+    return len(client.batches)
+
+
+def check_cleanup(rig):
+    world = StubWorld(2)
+    client = StubClient(world, failing=[rig[-1]['type']])
+    try:
+        spawn_rig(client, world, rig, types.SimpleNamespace(id=PARENT_ID), RESOLUTION)
+    except RuntimeError as error:
+        assert rig[-1]['name'] in str(error)
+    else:
+        raise AssertionError('a failed spawn does not raise')
+
+    assert len(client.batches) == 2, 'the cleanup takes %d batches' % (len(client.batches) - 1)
+    assert len(client.batches[1]) == len(rig) - 1
+    assert not world.actors, '%d sensors are left behind' % len(world.actors)
+
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(
+        description='spawn_rig against a stub client')
+    argparser.add_argument(
+        '--rig',
+        default=RIG_FILE,
+        help='sensor rig description (default: %s)' % os.path.relpath(RIG_FILE))
+    args = argparser.parse_args()
+
+    rig = load_rig(args.rig)
+    batches = check_spawn(rig)
+    print('spawn: %d sensors, one library fetch, %d batches for two rigs, actors in rig order' % (len(rig), batches))
+    check_cleanup(rig)
+    print('failed spawn: RuntimeError, the other %d sensors destroyed in one batch' % (len(rig) - 1))
@@ -0,0 +1,140 @@
+## The following code is a part of render off screen via image queues post at the Carla simulator research blog - https://carlasimblog.wordpress.com/2023/10/18/computer-queues-and-their-use-in-carla-simulator-to-render-large-images-without-image-drops/.
+## Feel free to show your support via requested, suggestions and interesting ideas for future research material.
+
+## Check of the SensorSynchronizer bundle logic with fake images and a fake clock, no simulator needed: complete
+## bundles in frame order, a frame a sensor skipped, a sensor past its timeout, late images of frames that were
+## already handed out or abandoned, and a sensor that stops delivering altogether.
+
+import argparse
+import types
+
+from sensor_synchronizer import SensorSynchronizer
+
+SENSORS = ['rgb', 'semantic', 'depth']
+TIMEOUT = 2.0
+FRAMES = 1000
+# seconds between two ticks of the fake clock
+TICK = 0.05
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def deliver(synchronizer, sensor, frame):
+    synchronizer.callback(sensor)(types.SimpleNamespace(frame=frame, sensor=sensor))
+
+
+def bundles(synchronizer):
+    # every bundle that is complete now, get() with a zero timeout never blocks
+    result = []
+    while True:
+        bundle = synchronizer.get(timeout=0)
+        if bundle is None:
+            return result
+        result.append(bundle)
+
+
+def check_order():
+    synchronizer = SensorSynchronizer(SENSORS, clock=FakeClock())
+    # the sensors deliver in their own order and the callbacks interleave
+    for sensor in reversed(SENSORS):
+        for frame in range(1, 6):
+            deliver(synchronizer, sensor, frame)
+
+    handed_out = bundles(synchronizer)
+    assert [frame for frame, _ in handed_out] == [1, 2, 3, 4, 5], 'bundles are not in frame order'
+    for frame, images in handed_out:
+        assert sorted(images) == sorted(SENSORS)
+        assert all(image.frame == frame and image.sensor == sensor for sensor, image in images.items())
+    assert synchronizer.partial == 0 and synchronizer.late == 0
+    return len(handed_out)
+
+
+def check_skip():
+    synchronizer = SensorSynchronizer(SENSORS, clock=FakeClock())
+    for frame in (1, 2, 3):
+        for sensor in SENSORS:
+            if sensor != 'depth' or frame != 2:
+                deliver(synchronizer, sensor, frame)
+
+    assert [frame for frame, _ in bundles(synchronizer)] == [1, 3], 'the skipped frame is handed out'
+    assert synchronizer.partial == 1
+    assert synchronizer.dropped == {'rgb': 0, 'semantic': 0, 'depth': 1}
+
+
+def check_timeout():
+    clock = FakeClock()
+    # rgb is missing and has the shorter timeout, it decides when the frame is given up
+    synchronizer = SensorSynchronizer(SENSORS, timeout={'rgb': 0.5, 'semantic': TIMEOUT, 'depth': TIMEOUT},
+                                      clock=clock)
+    deliver(synchronizer, 'semantic', 1)
+    deliver(synchronizer, 'depth', 1)
+    # the clock starts for a frame when the consumer takes its first image from the queue
+    assert not bundles(synchronizer)
+
+    clock.now = 0.4
+    assert not bundles(synchronizer) and synchronizer.stats()['pending'] == 1, 'the frame expired too early'
+    clock.now = 0.6
+    assert not bundles(synchronizer) and synchronizer.stats()['pending'] == 0, 'the frame did not expire'
+    assert synchronizer.partial == 1 and synchronizer.dropped['rgb'] == 1
+
+    # the image arrives after all, it is late and does not start the frame again
+    deliver(synchronizer, 'rgb', 1)
+    assert not bundles(synchronizer)
+    assert synchronizer.late == 1 and synchronizer.stats()['pending'] == 0
+
+
+def check_late():
+    synchronizer = SensorSynchronizer(SENSORS, clock=FakeClock())
+    for sensor in SENSORS:
+        deliver(synchronizer, sensor, 1)
+    assert len(bundles(synchronizer)) == 1
+
+    # a second image of a frame already handed out
+    deliver(synchronizer, 'rgb', 1)
+    assert not bundles(synchronizer)
+    assert synchronizer.late == 1 and synchronizer.bundles == 1
+
+
+def check_dead_sensor(frames):
+    clock = FakeClock()
+    synchronizer = SensorSynchronizer(SENSORS, timeout=TIMEOUT, clock=clock)
+    largest = 0
+    for frame in range(1, frames + 1):
+        clock.now = frame * TICK
+        for sensor in SENSORS[:-1]:
+            deliver(synchronizer, sensor, frame)
+        assert not bundles(synchronizer)
+        largest = max(largest, len(synchronizer.abandoned))
+
+    # nothing is ever emitted, the abandoned frames are forgotten once they are older than the timeout
+    bound = int(TIMEOUT / TICK) + 1
+    assert largest <= bound, '%d abandoned frames kept, at most %d expected' % (largest, bound)
+    assert synchronizer.bundles == 0 and synchronizer.dropped[SENSORS[-1]] == synchronizer.partial
+    return largest
+
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(
+        description='SensorSynchronizer bundles with fake images and a fake clock')
+    argparser.add_argument(
+        '--frames',
+        default=FRAMES,
+        type=int,
+        help='ticks of the sensor that stops delivering (default: %d)' % FRAMES)
+    args = argparser.parse_args()
+
+    print('order: %d bundles in frame order from interleaved callbacks' % check_order())
+    check_skip()
+    print('skip: the skipped frame is dropped and counted for its sensor')
+    check_timeout()
+    print('timeout: a frame waits the timeout of its missing sensor, its late image is counted')
+    check_late()
+    print('late: a second image of a handed out frame is counted and dropped')
+    largest = check_dead_sensor(args.frames)
+    print('dead sensor: %d ticks, at most %d abandoned frames remembered' % (args.frames, largest))
@@ -0,0 +1,168 @@
+## The following code is a part of disparity measurements section at the Carla simulator research blog - https://carlasimblog.wordpress.com/2023/09/20/disparity-in-stereo-cameras-measuring-understanding-and-its-crucial-role/.
+## Feel free to show your support via requested, suggestions and interesting ideas for future research material.
+
+## Batch mode for the block matcher: stereo pairs are streamed from a directory or a manifest through a pool of
+## worker processes. Results are cached by a hash of the input pixels and the matcher parameters, so a re-run
+## after a parameter sweep only computes the pairs whose inputs or parameters changed.
+
+import argparse
+import csv
+import hashlib
+import json
+import os
+import shutil
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import cv2
+
+import manual_block_matching
+from manual_block_matching import add_matcher_arguments, get_disparity_map, matcher_options
+from temporal_block_matching import list_stereo_sequence
+
+# bumped whenever a change in the engine changes its results, old cache entries are then never hit again
+CACHE_VERSION = 1
+CACHE_DIR = '_cache/disparity'
+# pairs submitted to the pool per worker, enough to keep the workers busy without reading the whole list
+PAIRS_IN_FLIGHT = 4
+
+
+def read_manifest(path):
+    # csv lines "left,right[,name]", relative paths are taken from the manifest directory
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, newline='') as manifest:
+        for row in csv.reader(manifest):
+            if not row or row[0].startswith('#'):
+                continue
+            left_path, right_path = (os.path.join(base, p.strip()) for p in row[:2])
+            if len(row) > 2:
+                name = row[2].strip()
+            else:
+                name = os.path.splitext(os.path.basename(left_path))[0]
+            yield name, left_path, right_path
+
+
+def cache_key(left_img, right_img, mode, mode_options):
+    # hash of the pixels, not the files, so re-encoded or renamed images still hit the cache
+    params = dict(mode_options, mode=mode, block_size=manual_block_matching.BLOCK_SIZE,
+                  search_block_size=manual_block_matching.SEARCH_BLOCK_SIZE, version=CACHE_VERSION)
+    digest = hashlib.blake2b(json.dumps(params, sort_keys=True).encode(), digest_size=20)
+    for img in (left_img, right_img):
+        digest.update(str(img.shape).encode())
+        digest.update(img.tobytes())
+    return digest.hexdigest()
+
+
+def cache_path(cache_dir, key):
+    return os.path.join(cache_dir, key[:2], key + '.npz')
+
+
+def process_pair(name, left_path, right_path, mode, mode_options, cache_dir, output_dir):
+    # runs in a worker: (name, cache key, cache hit, seconds spent)
+    t_start = time.perf_counter()
+    left_img = cv2.imread(left_path)
+    right_img = cv2.imread(right_path)
+    if left_img is None or right_img is None:
+        raise IOError("Could not read pair %s (%s, %s)" % (name, left_path, right_path))
+    left_img = cv2.cvtColor(left_img, cv2.COLOR_BGR2RGB)
+    right_img = cv2.cvtColor(right_img, cv2.COLOR_BGR2RGB)
+
+    key = cache_key(left_img, right_img, mode, mode_options)
+    path = cache_path(cache_dir, key)
+    hit = os.path.exists(path)
+    if not hit:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # written next to the entry and renamed, an interrupted run never leaves a truncated entry behind
+        temp_path = '%s.%d.tmp.npz' % (path[:-len('.npz')], os.getpid())
+        get_disparity_map(left_img, right_img, mode=mode, output_path=temp_path, **mode_options)
+        os.replace(temp_path, path)
+
+    if output_dir:
+        output_path = os.path.join(output_dir, '%s_disp.npz' % name)
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        try:
+            os.link(path, output_path)
+        except OSError:
+            shutil.copyfile(path, output_path)
+
+    return name, key, hit, time.perf_counter() - t_start
+
+
+def run_batch(pairs, mode='vectorized', mode_options=None, cache_dir=CACHE_DIR, output_dir=None,
+              jobs=os.cpu_count()):
+    """Generator over (name, cache key, cache hit, seconds, error) for every (name, left path, right path) pair.
+
+    The pairs iterable is consumed lazily with a bounded number of pairs in flight, so a manifest of
+    hundreds of thousands of pairs is never held in memory. Results come back in completion order.
+    A pair that fails (unreadable image, shape mismatch, ...) does not stop the batch, it comes back
+    as (name, None, False, 0.0, error) with the exception as error, which is None otherwise.
+    """
+    mode_options = mode_options or {}
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    pairs = iter(pairs)
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        # future: pair name, the name of a failed pair is only known here
+        pending = {}
+        while True:
+            for name, left_path, right_path in pairs:
+                pending[executor.submit(process_pair, name, left_path, right_path, mode, mode_options,
+                                        cache_dir, output_dir)] = name
+                if len(pending) >= jobs * PAIRS_IN_FLIGHT:
+                    break
+            if not pending:
+                return
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = pending.pop(future)
+                try:
+                    yield future.result() + (None,)
+                except Exception as error:
+                    yield name, None, False, 0.0, error
+
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(
+        description='Block matching disparity over a directory or manifest of stereo pairs')
+    argparser.add_argument(
+        'source',
+        help='directory with <name>_l.png / <name>_r.png pairs, or a csv manifest of left,right[,name] lines')
+    argparser.add_argument(
+        '--output-dir',
+        default=None,
+        help='also write <name>_disp.npz for every pair here (default: results only go to the cache)')
+    argparser.add_argument(
+        '--cache-dir',
+        default=CACHE_DIR,
+        help='result cache keyed by input pixels and matcher parameters (default: %s)' % CACHE_DIR)
+    argparser.add_argument(
+        '--jobs',
+        default=os.cpu_count(),
+        type=int,
+        help='number of pairs processed in parallel (default: all cores)')
+    add_matcher_arguments(argparser)
+    args = argparser.parse_args()
+    if args.mode == 'parallel':
+        argparser.error('the parallel mode already uses every core, use --jobs to spread pairs over workers')
+
+    if os.path.isdir(args.source):
+        pairs = list_stereo_sequence(args.source)
+    else:
+        pairs = read_manifest(args.source)
+
+    processed = hits = failed = 0
+    t_start = time.perf_counter()
+    for name, key, hit, seconds, error in run_batch(pairs, args.mode, matcher_options(args), args.cache_dir,
+                                                    args.output_dir, args.jobs):
+        processed += 1
+        if error is not None:
+            failed += 1
+            print('%s: failed, %s' % (name, error))
+            continue
+        hits += hit
+        print('%s: %s %.3fs%s' % (name, key[:12], seconds, ' (cached)' if hit else ''))
+
+    t_total = time.perf_counter() - t_start
+    print('%d pairs in %.1fs, %d from the cache, %d failed' % (processed, t_total, hits, failed))
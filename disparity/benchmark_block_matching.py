@@ -0,0 +1,291 @@
+## The following code is a part of disparity measurements section at the Carla simulator research blog - https://carlasimblog.wordpress.com/2023/09/20/disparity-in-stereo-cameras-measuring-understanding-and-its-crucial-role/.
+## Feel free to show your support via requested, suggestions and interesting ideas for future research material.
+
+## Benchmark for the block matching modes: synthetic stereo pairs with a known disparity are rendered offline
+## (no CARLA needed), every mode runs on them in a fresh process, and speed, peak memory and accuracy are
+## written to a json file that can be compared across versions.
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import resource
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+from manual_block_matching import (BLOCK_SIZE, COST_VOLUME_MODES, MATCHING_MODES, SEARCH_BLOCK_SIZE,
+                                   get_refined_disparity_map)
+from temporal_block_matching import get_disparity_sequence
+
+RESOLUTIONS = '128x96,640x480,1280x960'
+SCENES = ('planes', 'slanted', 'occlusion')
+# errors above this many pixels count as bad pixels
+BAD_PIXEL_THRESHOLD = 1.0
+# the per-pixel reference loop is only run up to this image size
+REFERENCE_MAX_PIXELS = 96 * 128
+RESULTS_PATH = 'benchmark_results.json'
+# disparities of an approaching box over a sequence, it leaves the search range of the temporal mode halfway
+SEQUENCE_DISPARITIES = range(SEARCH_BLOCK_SIZE - 8, SEARCH_BLOCK_SIZE + 10, 2)
+# frames of the static sequence the temporal mode is timed on, after its first frame, which is a full search
+TEMPORAL_FRAMES = 4
+
+# (case name, mode, mode options), every matching mode with its defaults plus the census and refined variants,
+# and the temporal mode of temporal_block_matching.py
+BENCHMARK_CASES = [
+    ('reference', 'reference', {}),
+    ('vectorized', 'vectorized', {}),
+    ('vectorized-census', 'vectorized', {'matching_cost': 'census'}),
+    ('vectorized-refine', 'vectorized', {'refine': True}),
+    ('parallel', 'parallel', {}),
+    ('tiled', 'tiled', {}),
+    ('sgm', 'sgm', {}),
+    ('sgm-census', 'sgm', {'matching_cost': 'census'}),
+    ('sgm-refine', 'sgm', {'refine': True}),
+    ('pyramid', 'pyramid', {}),
+    ('temporal', 'temporal', {}),
+]
+
+
+def texture(h, w, rng):
+    # band-limited noise at two scales, enough structure for every block to have a unique match
+    fine = cv2.GaussianBlur(rng.integers(0, 256, (h, w)).astype(np.float32), (0, 0), 1.0)
+    coarse = cv2.resize(rng.integers(0, 256, (h // 8 + 1, w // 8 + 1)).astype(np.float32), (w, h),
+                        interpolation=cv2.INTER_CUBIC)
+    return cv2.normalize(fine + 0.5 * coarse, None, 0, 255, cv2.NORM_MINMAX)
+
+
+def render_right(left, disparity, rng):
+    """Forward-warp the left image by an integer disparity map.
+
+    Where several left pixels land on the same right pixel the nearest one (largest disparity) wins,
+    right pixels no left pixel lands on are background only the right camera sees and get fresh noise.
+    Returns the right image and the mask of left pixels that are visible in it.
+    """
+    h, w = disparity.shape
+    ys, xs = np.mgrid[0:h, 0:w]
+    x_right = xs - disparity.astype(int)
+    inside = (x_right >= 0).ravel()
+
+    # pixels written in order of increasing disparity, so the nearest surface is written last
+    order = np.argsort(disparity.ravel()[inside], kind='stable')
+    sources = np.flatnonzero(inside)[order]
+    owner = np.full(h * w, -1)
+    owner[ys.ravel()[sources] * w + x_right.ravel()[sources]] = sources
+
+    right = np.empty(h * w, dtype=np.float32)
+    written = owner >= 0
+    right[written] = left.ravel()[owner[written]]
+    right[~written] = rng.integers(0, 256, np.count_nonzero(~written))
+    visible = np.zeros(h * w, dtype=bool)
+    visible[owner[written]] = True
+    return right.reshape(h, w), visible.reshape(h, w)
+
+
+def synthetic_pair(scene, h, w, seed=0):
+    """Left image, right image, ground-truth disparity and mask of the pixels it is defined on.
+
+    planes: fronto-parallel rectangles at several disparities in front of a far background.
+    slanted: a single plane whose disparity changes along both axes, sub-pixel ground truth.
+    occlusion: a ground plane with two boxes standing on it, wide occluded bands along the box edges.
+    """
+    rng = np.random.default_rng(seed)
+    left = texture(h, w, rng)
+    ys, xs = np.mgrid[0:h, 0:w].astype(np.float64)
+
+    if scene == 'slanted':
+        # d = a + b x + c y, the right image is sampled exactly at x_left = (x_right + a + c y) / (1 - b)
+        a, b, c = 4, 30 / w, 16 / h
+        disparity = a + b * xs + c * ys
+        map_x = ((xs + a + c * ys) / (1 - b)).astype(np.float32)
+        right = cv2.remap(left, map_x, ys.astype(np.float32), cv2.INTER_LINEAR, borderMode=cv2.BORDER_REFLECT)
+        visible = xs - disparity >= 0
+    else:
+        if scene == 'planes':
+            disparity = np.full((h, w), 6.0)
+            boxes = [(0.1, 0.35, 0.15, 0.5, 20), (0.3, 0.55, 0.45, 0.7, 34), (0.55, 0.9, 0.6, 0.9, 48)]
+        elif scene == 'occlusion':
+            disparity = np.where(ys > 0.4 * h, 4 + (ys - 0.4 * h) * 40 / (0.6 * h), 2)
+            boxes = [(0.2, 0.35, 0.3, 0.7, 30), (0.6, 0.8, 0.35, 0.8, 45)]
+        else:
+            raise ValueError("Unknown scene %s" % scene)
+        for x0, x1, y0, y1, box_disparity in boxes:
+            disparity[int(y0 * h):int(y1 * h), int(x0 * w):int(x1 * w)] = box_disparity
+        disparity = np.round(disparity)
+        right, visible = render_right(left, disparity, rng)
+
+    defined = visible.copy()
+    defined[:BLOCK_SIZE, :] = defined[h - BLOCK_SIZE:, :] = False
+    defined[:, :BLOCK_SIZE] = defined[:, w - BLOCK_SIZE:] = False
+    return left.astype(np.uint8), right.astype(np.uint8), disparity, defined
+
+
+def sequence_pairs(h, w, disparities, seed=0):
+    # one frame per disparity of a box over a far background, (name, left, right, disparity, defined)
+    rng = np.random.default_rng(seed)
+    left = texture(h, w, rng)
+    for i, box_disparity in enumerate(disparities):
+        disparity = np.full((h, w), 6.0)
+        disparity[h // 4:3 * h // 4, w // 3:2 * w // 3] = box_disparity
+        right, visible = render_right(left, disparity, rng)
+        defined = visible & (disparity <= SEARCH_BLOCK_SIZE)
+        defined[:BLOCK_SIZE, :] = defined[h - BLOCK_SIZE:, :] = False
+        defined[:, :BLOCK_SIZE] = defined[:, w - BLOCK_SIZE:] = False
+        # the temporal mode reads rgb frames like the pngs of create_data_for_disparity.py
+        yield ('%03d' % i, cv2.cvtColor(left.astype(np.uint8), cv2.COLOR_GRAY2RGB),
+               cv2.cvtColor(right.astype(np.uint8), cv2.COLOR_GRAY2RGB), disparity, defined)
+
+
+def run_sequence_check(h, w, disparities=SEQUENCE_DISPARITIES):
+    # the temporal mode over a box whose disparity drifts out of the search range, generator over one result
+    # dict per frame, the pixels beyond the range have no ground truth the matcher can reach
+    frames = list(sequence_pairs(h, w, disparities))
+    pairs = [(name, left, right) for name, left, right, _, _ in frames]
+    for (name, _, _, ground_truth, defined), (_, disparity_map, fallback) in zip(
+            frames, get_disparity_sequence(pairs)):
+        epe, bad_percent, _ = accuracy(disparity_map, np.ones(defined.shape, dtype=bool), ground_truth, defined)
+        yield {'frame': name, 'box_disparity': int(ground_truth[h // 2, w // 2]), 'epe': epe,
+               'bad_percent': bad_percent, 'fallback': fallback,
+               'in_range': bool(disparity_map.max() <= SEARCH_BLOCK_SIZE)}
+
+
+def temporal_map(left_array, right_array, frames=TEMPORAL_FRAMES):
+    # the temporal mode on a static sequence of the pair, the disparity map of its last frame and the seconds per
+    # frame after the first, the steady state the mode runs in over a recorded drive
+    left, right = [cv2.cvtColor(array.astype(np.uint8), cv2.COLOR_GRAY2RGB) for array in (left_array, right_array)]
+    sequence = get_disparity_sequence(('%03d' % i, left, right) for i in range(frames + 1))
+    next(sequence)
+    t_start = time.perf_counter()
+    for _, disparity_map, _ in sequence:
+        pass
+    return disparity_map, (time.perf_counter() - t_start) / frames
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on linux, the workers of the parallel mode are children
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss +
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / 1024
+
+
+def run_case(mode, mode_options, left_array, right_array):
+    # runs in a fresh process so peak memory is the peak of this case alone
+    rss_start = peak_rss_mb()
+    mode_options = dict(mode_options)
+    if mode == 'temporal':
+        disparity_map, seconds = temporal_map(left_array, right_array, **mode_options)
+        return disparity_map, np.ones(disparity_map.shape, dtype=bool), seconds, peak_rss_mb() - rss_start
+
+    t_start = time.perf_counter()
+    if mode_options.pop('refine', False):
+        disparity_map, valid = get_refined_disparity_map(left_array, right_array, mode, **mode_options)
+    else:
+        disparity_map = MATCHING_MODES[mode](left_array, right_array, **mode_options)
+        valid = np.ones(disparity_map.shape, dtype=bool)
+    seconds = time.perf_counter() - t_start
+    return disparity_map, valid, seconds, peak_rss_mb() - rss_start
+
+
+def accuracy(disparity_map, valid, ground_truth, defined):
+    # end-point error and bad pixels over the pixels with a ground truth and an estimate
+    evaluated = defined & valid
+    error = np.abs(disparity_map[evaluated] - ground_truth[evaluated])
+    if error.size == 0:
+        return float('nan'), float('nan'), 0.0
+    return (float(error.mean()), float(100 * np.mean(error > BAD_PIXEL_THRESHOLD)),
+            float(evaluated.sum() / defined.sum()))
+
+
+def parse_resolutions(resolutions):
+    # 'WxH,WxH' like the --res of the capture scripts, as (height, width) pairs of the image arrays
+    return [tuple(int(v) for v in resolution.split('x'))[::-1] for resolution in resolutions.split(',')]
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run_benchmark(cases, scenes, resolutions):
+    # generator over one result dict per (case, scene, resolution)
+    for h, w in resolutions:
+        for scene in scenes:
+            left, right, ground_truth, defined = synthetic_pair(scene, h, w)
+            left_array, right_array = left.astype(int), right.astype(int)
+            for name, mode, mode_options in cases:
+                if mode == 'reference' and h * w > REFERENCE_MAX_PIXELS:
+                    continue
+                if mode_options.get('refine') and mode not in COST_VOLUME_MODES:
+                    continue
+                with ProcessPoolExecutor(max_workers=1) as executor:
+                    disparity_map, valid, seconds, peak_mb = executor.submit(
+                        run_case, mode, mode_options, left_array, right_array).result()
+                epe, bad_percent, density = accuracy(disparity_map, valid, ground_truth, defined)
+                yield {'case': name, 'mode': mode, 'options': mode_options, 'scene': scene,
+                       'height': h, 'width': w, 'seconds': seconds, 'mpix_per_s': h * w / seconds / 1e6,
+                       'peak_mb': peak_mb, 'epe': epe, 'bad_percent': bad_percent, 'density': density}
+
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(
+        description='Speed, memory and accuracy of every block matching mode on synthetic stereo pairs')
+    argparser.add_argument(
+        '--resolutions',
+        default=RESOLUTIONS,
+        help='comma separated WxH image sizes (default: %s)' % RESOLUTIONS)
+    argparser.add_argument(
+        '--cases',
+        default=','.join(name for name, _, _ in BENCHMARK_CASES),
+        help='comma separated subset of the benchmark cases (default: all)')
+    argparser.add_argument(
+        '--scenes',
+        default=','.join(SCENES),
+        help='comma separated subset of %s (default: all)' % ', '.join(SCENES))
+    argparser.add_argument(
+        '--output',
+        default=RESULTS_PATH,
+        help='json results file (default: %s)' % RESULTS_PATH)
+    argparser.add_argument(
+        '--sequence',
+        action='store_true',
+        help='only check the temporal mode on a sequence that leaves the search range, at the first resolution')
+    args = argparser.parse_args()
+
+    if args.sequence:
+        h, w = parse_resolutions(args.resolutions)[0]
+        print('%-6s %9s %8s %6s %9s %9s' % ('frame', 'disparity', 'EPE', 'bad%', 'fallback', 'in range'))
+        for result in run_sequence_check(h, w):
+            print('%(frame)-6s %(box_disparity)9d %(epe)8.3f %(bad_percent)6.2f %(fallback)9.3f %(in_range)9s'
+                  % result)
+        raise SystemExit
+
+    selected = args.cases.split(',')
+    unknown = set(selected) - {name for name, _, _ in BENCHMARK_CASES}
+    if unknown:
+        argparser.error('unknown cases: %s' % ', '.join(sorted(unknown)))
+    cases = [case for case in BENCHMARK_CASES if case[0] in selected]
+
+    results = []
+    print('%-18s %-10s %10s %8s %9s %8s %6s %7s' % ('case', 'scene', 'size', 'MP/s', 'peak MB', 'EPE', 'bad%',
+                                                      'density'))
+    for result in run_benchmark(cases, args.scenes.split(','), parse_resolutions(args.resolutions)):
+        results.append(result)
+        print('%-18s %-10s %10s %8.3f %9.0f %8.3f %6.2f %7.3f' % (
+            result['case'], result['scene'], '%dx%d' % (result['width'], result['height']), result['mpix_per_s'],
+            result['peak_mb'], result['epe'], result['bad_percent'], result['density']))
+
+    with open(args.output, 'w') as output:
+        json.dump({'created': datetime.datetime.now().isoformat(timespec='seconds'),
+                   'commit': git_commit(),
+                   'python': platform.python_version(),
+                   'numpy': np.__version__,
+                   'opencv': cv2.__version__,
+                   'cpu_count': os.cpu_count(),
+                   'bad_pixel_threshold': BAD_PIXEL_THRESHOLD,
+                   'results': results}, output, indent=2)
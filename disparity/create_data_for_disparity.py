@@ -1,6 +1,9 @@
 ## The following code is a part of disparity measurements section at the Carla simulator research blog - https://carlasimblog.wordpress.com/2023/09/20/disparity-in-stereo-cameras-measuring-understanding-and-its-crucial-role/.
 ## Feel free to show your support via requested, suggestions and interesting ideas for future research material.
 
+## Run it from the repository root as python -m disparity.create_data_for_disparity, it shares the rig, image writer
+## and display managers with data_collection.py.
+
 import glob
 import os
 import sys
@@ -19,230 +22,65 @@ import random
 import time
 import numpy as np
 
+from frame_ring import rig_slot_size
+from image_writer import ImageWriter, WRITER_POLICIES, WRITER_QUEUE_SIZE, WRITER_WORKERS
+from pipeline_metrics import METRICS_INTERVAL, PipelineMetrics
+from sensor_display import PREVIEW_FPS, DisplayManager, SensorManager
+from sensor_rig import load_rig, rig_grid_size, spawn_rig
+from tick_scheduler import LATENCY_BUDGET, MAX_CAPTURE_EVERY, MAX_TICK_DELAY, TickScheduler
 
-try:
-    import pygame
-    from pygame.locals import KMOD_CTRL
-    from pygame.locals import KMOD_SHIFT
-    from pygame.locals import K_0
-    from pygame.locals import K_9
-    from pygame.locals import K_BACKQUOTE
-    from pygame.locals import K_BACKSPACE
-    from pygame.locals import K_COMMA
-    from pygame.locals import K_DOWN
-    from pygame.locals import K_ESCAPE
-    from pygame.locals import K_F1
-    from pygame.locals import K_LEFT
-    from pygame.locals import K_PERIOD
-    from pygame.locals import K_RIGHT
-    from pygame.locals import K_SLASH
-    from pygame.locals import K_SPACE
-    from pygame.locals import K_TAB
-    from pygame.locals import K_UP
-    from pygame.locals import K_a
-    from pygame.locals import K_b
-    from pygame.locals import K_c
-    from pygame.locals import K_d
-    from pygame.locals import K_f
-    from pygame.locals import K_g
-    from pygame.locals import K_h
-    from pygame.locals import K_i
-    from pygame.locals import K_l
-    from pygame.locals import K_m
-    from pygame.locals import K_n
-    from pygame.locals import K_o
-    from pygame.locals import K_p
-    from pygame.locals import K_q
-    from pygame.locals import K_r
-    from pygame.locals import K_s
-    from pygame.locals import K_t
-    from pygame.locals import K_v
-    from pygame.locals import K_w
-    from pygame.locals import K_x
-    from pygame.locals import K_z
-    from pygame.locals import K_MINUS
-    from pygame.locals import K_EQUALS
-except ImportError:
-    raise RuntimeError('cannot import pygame, make sure pygame package is installed')
-
-class CustomTimer:
-    def __init__(self):
-        try:
-            self.timer = time.perf_counter
-        except AttributeError:
-            self.timer = time.time
-
-    def time(self):
-        return self.timer()
-
-class DisplayManager:
-    def __init__(self, grid_size, window_size):
-        pygame.init()
-        pygame.font.init()
-        self.display = pygame.display.set_mode(window_size, pygame.HWSURFACE | pygame.DOUBLEBUF)
-
-        self.grid_size = grid_size
-        self.window_size = window_size
-        self.sensor_list = []
-
-    def get_window_size(self):
-        return [int(self.window_size[0]), int(self.window_size[1])]
-
-    def get_display_size(self):
-        return [int(self.window_size[0]/self.grid_size[1]), int(self.window_size[1]/self.grid_size[0])]
-
-    def get_display_offset(self, gridPos):
-        dis_size = self.get_display_size()
-        return [int(gridPos[1] * dis_size[0]), int(gridPos[0] * dis_size[1])]
-
-    def add_sensor(self, sensor):
-        self.sensor_list.append(sensor)
-
-    def get_sensor_list(self):
-        return self.sensor_list
-
-    def render(self):
-        if not self.render_enabled():
-            return
-
-        for s in self.sensor_list:
-            s.render()
-
-        pygame.display.flip()
-
-    def destroy(self):
-        for s in self.sensor_list:
-            s.destroy()
-
-    def render_enabled(self):
-        return self.display != None
-
-class SensorManager:
-    def __init__(self, world, display_man, sensor_type, transform, attached, sensor_options, display_pos):
-        self.surface = None
-        self.world = world
-        self.display_man = display_man
-        self.display_pos = display_pos
-        self.sensor = self.init_sensor(sensor_type, transform, attached, sensor_options)
-        self.sensor_options = sensor_options
-        self.timer = CustomTimer()
-
-        self.time_processing = 0.01
-        self.tics_processing = 0
-
-        self.display_man.add_sensor(self)
-
-    def init_sensor(self, sensor_type, transform, attached, sensor_options):
-        if sensor_type == 'RGBCamera':
-            camera_bp = self.world.get_blueprint_library().find('sensor.camera.rgb')
-            disp_size = self.display_man.get_display_size()
-            camera_bp.set_attribute('image_size_x', str(disp_size[0]))
-            camera_bp.set_attribute('image_size_y', str(disp_size[1]))
-            camera_bp.set_attribute('fov', str(14))
-
-            for key in sensor_options:
-                camera_bp.set_attribute(key, sensor_options[key])
-
-            camera = self.world.spawn_actor(camera_bp, transform, attach_to=attached)
-            camera.listen(self.save_rgb_image)
-
-            return camera
-
-        elif sensor_type == 'SemanticCamera':
-            camera_bp = self.world.get_blueprint_library().find('sensor.camera.semantic_segmentation')
-            disp_size = self.display_man.get_display_size()
-            camera_bp.set_attribute('image_size_x', str(disp_size[0]))
-            camera_bp.set_attribute('image_size_y', str(disp_size[1]))
-            camera_bp.set_attribute('fov', str(14))
-
-            for key in sensor_options:
-                camera_bp.set_attribute(key, sensor_options[key])
-
-            camera = self.world.spawn_actor(camera_bp, transform, attach_to=attached)
-            camera.listen(self.save_semantic_image)
-
-            return camera
-
-        elif sensor_type == 'DepthCamera':
-            camera_bp = self.world.get_blueprint_library().find('sensor.camera.depth')
-            disp_size = self.display_man.get_display_size()
-            camera_bp.set_attribute('image_size_x', str(disp_size[0]))
-            camera_bp.set_attribute('image_size_y', str(disp_size[1]))
-            camera_bp.set_attribute('fov', str(14))
-
-            for key in sensor_options:
-                camera_bp.set_attribute(key, sensor_options[key])
-
-            camera = self.world.spawn_actor(camera_bp, transform, attach_to=attached)
-            camera.listen(self.save_depth_image)
-
-            return camera
-        
-        else:
-            return None
-
-    def get_sensor(self):
-        return self.sensor
-
-    def save_rgb_image(self, image):
-        t_start = self.timer.time()
-
-        image.convert(carla.ColorConverter.Raw)
-        array = np.frombuffer(image.raw_data, dtype=np.dtype("uint8"))
-        array = np.reshape(array, (image.height, image.width, 4))
-        array = array[:, :, :3]
-        array = array[:, :, ::-1]
-
-        if self.display_man.render_enabled():
-            self.surface = pygame.surfarray.make_surface(array.swapaxes(0, 1))
-
-        t_end = self.timer.time()
-        self.time_processing += (t_end-t_start)
-        self.tics_processing += 1
-        image.save_to_disk('_out/multiple_sensors/raw/%08d_rgb.png' % image.frame)
+RIG_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'rigs', 'disparity.json')
 
-    def save_depth_image(self, image):
-        t_start = self.timer.time()
 
-        image.convert(carla.ColorConverter.Raw)
-        array = np.frombuffer(image.raw_data, dtype=np.dtype("uint8"))
-        array = np.reshape(array, (image.height, image.width, 4))
-        array = array[:, :, :3]
-        array = array[:, :, ::-1]
+# --headless never imports nor initializes pygame, so it has to be known before the imports
+HEADLESS = '--headless' in sys.argv
 
-        if self.display_man.render_enabled():
-            self.surface = pygame.surfarray.make_surface(array.swapaxes(0, 1))
-
-        t_end = self.timer.time()
-        self.time_processing += (t_end - t_start)
-        self.tics_processing += 1
-        image.save_to_disk('_out/multiple_sensors/raw/%08d_depth.png' % image.frame)
-
-    def save_semantic_image(self, image):
-        t_start = self.timer.time()
-
-        image.convert(carla.ColorConverter.Raw)
-        array = np.frombuffer(image.raw_data, dtype=np.dtype("uint8"))
-        array = np.reshape(array, (image.height, image.width, 4))
-        array = array[:, :, :3]
-        array = array[:, :, ::-1]
-
-        if self.display_man.render_enabled():
-            self.surface = pygame.surfarray.make_surface(array.swapaxes(0, 1))
-
-        t_end = self.timer.time()
-        self.time_processing += (t_end - t_start)
-        self.tics_processing += 1
-        image.save_to_disk('_out/multiple_sensors/raw/%08d_semantic.png' % image.frame, carla.ColorConverter.CityScapesPalette)
-
-
-    def render(self):
-        if self.surface is not None:
-            offset = self.display_man.get_display_offset(self.display_pos)
-            self.display_man.display.blit(self.surface, offset)
+if not HEADLESS:
+    try:
+        import pygame
+        from pygame.locals import KMOD_CTRL
+        from pygame.locals import KMOD_SHIFT
+        from pygame.locals import K_0
+        from pygame.locals import K_9
+        from pygame.locals import K_BACKQUOTE
+        from pygame.locals import K_BACKSPACE
+        from pygame.locals import K_COMMA
+        from pygame.locals import K_DOWN
+        from pygame.locals import K_ESCAPE
+        from pygame.locals import K_F1
+        from pygame.locals import K_LEFT
+        from pygame.locals import K_PERIOD
+        from pygame.locals import K_RIGHT
+        from pygame.locals import K_SLASH
+        from pygame.locals import K_SPACE
+        from pygame.locals import K_TAB
+        from pygame.locals import K_UP
+        from pygame.locals import K_a
+        from pygame.locals import K_b
+        from pygame.locals import K_c
+        from pygame.locals import K_d
+        from pygame.locals import K_f
+        from pygame.locals import K_g
+        from pygame.locals import K_h
+        from pygame.locals import K_i
+        from pygame.locals import K_l
+        from pygame.locals import K_m
+        from pygame.locals import K_n
+        from pygame.locals import K_o
+        from pygame.locals import K_p
+        from pygame.locals import K_q
+        from pygame.locals import K_r
+        from pygame.locals import K_s
+        from pygame.locals import K_t
+        from pygame.locals import K_v
+        from pygame.locals import K_w
+        from pygame.locals import K_x
+        from pygame.locals import K_z
+        from pygame.locals import K_MINUS
+        from pygame.locals import K_EQUALS
+    except ImportError:
+        raise RuntimeError('cannot import pygame, make sure pygame package is installed')
 
-    def destroy(self):
-        self.sensor.destroy()
 
 def run_simulation(args, client):
     """This function performed one test run using the args parameters
@@ -250,6 +88,9 @@ def run_simulation(args, client):
     """
 
     display_manager = None
+    writer = None
+    metrics = None
+    scheduler = None
     vehicle_list = []
     ind = 0
     car_speed = 30  # m/s
@@ -267,29 +108,61 @@ def run_simulation(args, client):
         vehicle_list.append(vehicle)
         vehicle.set_autopilot(True)
 
-        # Display Manager organize all the sensors an its display in a window
-        # If can easily configure the grid and the total window size
-        display_manager = DisplayManager(grid_size=[1, 3], window_size=[args.width*3, args.height])
+        # the sensors of the run, the writer ring is sized from their largest frame
+        rig = load_rig(args.rig)
 
-        # Then, SensorManager can be used to spawn RGBCamera, LiDARs and SemanticLiDARs as needed
-        # and assign each of them to a grid position, 
-        SensorManager(world, display_manager, 'RGBCamera', carla.Transform(carla.Location(x=2, z=1.7), carla.Rotation(yaw=0)),
-                      vehicle, {}, display_pos=[0, 0])
-        SensorManager(world, display_manager, 'DepthCamera', carla.Transform(carla.Location(x=2, z=1.7), carla.Rotation(yaw=0)),
-                      vehicle, {}, display_pos=[0, 1])
-        SensorManager(world, display_manager, 'SemanticCamera', carla.Transform(carla.Location(x=2, z=1.7), carla.Rotation(yaw=+0)),
-                      vehicle, {}, display_pos=[0, 2])
+        # per-sensor timings of every stage from the tick to the file, summarized every --metrics-interval seconds
+        if args.metrics or args.prometheus:
+            metrics = PipelineMetrics(args.metrics, args.metrics_interval, args.prometheus)
 
+        # png encoding runs on the writer threads, the sensor callbacks only queue the raw images
+        if args.writers > 0:
+            writer = ImageWriter(args.writers, args.writer_queue, args.writer_policy, args.writer_processes,
+                                 metrics=metrics, slot_size=rig_slot_size(rig, (args.width, args.height)))
+
+        # ticks are paced by how full the writer queue is and how far the callbacks lag behind the ticks
+        if args.pace:
+            probes = {}
+            if writer:
+                probes['writer queue'] = writer.load
+            if metrics:
+                probes['callback latency'] = lambda: metrics.recent_latency / LATENCY_BUDGET
+            scheduler = TickScheduler(probes, args.sync, max_delay=args.max_tick_delay,
+                                      max_capture_every=args.max_capture_every)
+
+        # Display Manager organize all the sensors an its display in a window
+        # the grid and the sensors come from the rig file, every tile is one sensor at the --res resolution
+        grid_size = rig_grid_size(rig)
+        display_manager = DisplayManager(grid_size=grid_size,
+                                         window_size=[args.width * grid_size[1], args.height * grid_size[0]],
+                                         headless=args.headless, preview_fps=args.preview_fps,
+                                         preview_decimation=args.preview_decimation)
+
+        # all the sensors of the rig are spawned with one batch, then each one gets its SensorManager
+        sensors = spawn_rig(client, world, rig, vehicle, display_manager.get_display_size())
+        for spec, sensor in zip(rig, sensors):
+            SensorManager(display_manager, sensor, spec, writer=writer, metrics=metrics, scheduler=scheduler)
 
         #Simulation loop
         call_exit = False
         while True:
             # Carla Tick
+            if scheduler:
+                scheduler.before_tick()
+            t_tick = time.perf_counter()
             if args.sync:
-                world.tick()
+                frame = world.tick()
 
             else:
-                world.wait_for_tick()
+                # in async mode the tick is only known when its snapshot arrives
+                frame = world.wait_for_tick().frame
+                t_tick = time.perf_counter()
+
+            if scheduler:
+                scheduler.after_tick(frame)
+            if metrics:
+                metrics.tick(frame, t_tick)
+                metrics.report()
 
             ind += 1
             if np.mod(ind, 50) == 0:
@@ -301,10 +174,8 @@ def run_simulation(args, client):
                 vehicle_list = []
                 vehicle_list.append(vehicle)
 
-            # Render received data
-            display_manager.render()
-
-            for event in pygame.event.get():
+            # received data is rendered by the preview thread, here only its events are handled
+            for event in display_manager.get_events():
                 if event.type == pygame.QUIT:
                     call_exit = True
                 elif event.type == pygame.KEYDOWN:
@@ -398,7 +269,6 @@ def run_simulation(args, client):
                             print("Autopilot mode OFF")
 
                         vehicle.set_autopilot(autopilot_enabled)
-                        pygame.display.update()
 
             if call_exit:
                 break
@@ -407,6 +277,15 @@ def run_simulation(args, client):
         if display_manager:
             display_manager.destroy()
 
+        if writer:
+            writer.close()
+            print(writer)
+        if metrics:
+            metrics.close()
+            print(metrics)
+        if scheduler:
+            print(scheduler)
+
         client.apply_batch([carla.command.DestroyActor(x) for x in vehicle_list])
 
         world.apply_settings(original_settings)
@@ -443,6 +322,71 @@ def main():
         default='960x1236',
         help='window resolution (default: 1284x480)')
 
+    argparser.add_argument(
+        '--rig',
+        default=RIG_FILE,
+        help='sensor rig description (default: %s)' % os.path.relpath(RIG_FILE))
+    argparser.add_argument(
+        '--headless',
+        action='store_true',
+        help='no window: pygame is never imported and the callbacks only store the images')
+    argparser.add_argument(
+        '--preview-fps',
+        default=PREVIEW_FPS,
+        type=float,
+        help='maximum refresh rate of the preview window, independent of the tick rate (default: %d)' % PREVIEW_FPS)
+    argparser.add_argument(
+        '--preview-decimation',
+        default=1,
+        type=int,
+        help='show every n-th pixel of the sensor images in the preview (default: 1)')
+    argparser.add_argument(
+        '--writers',
+        default=WRITER_WORKERS,
+        type=int,
+        help='number of png encoder threads, 0 writes inside the sensor callbacks (default: %d)' % WRITER_WORKERS)
+    argparser.add_argument(
+        '--writer-queue',
+        default=WRITER_QUEUE_SIZE,
+        type=int,
+        help='images waiting to be written before the policy applies (default: %d)' % WRITER_QUEUE_SIZE)
+    argparser.add_argument(
+        '--writer-policy',
+        default='block',
+        choices=WRITER_POLICIES,
+        help='what to do with a new image when the writer queue is full (default: block)')
+    argparser.add_argument(
+        '--writer-processes',
+        action='store_true',
+        help='encode in a process pool instead of the writer threads, the images go through shared memory')
+    argparser.add_argument(
+        '--pace',
+        action='store_true',
+        help='delay the ticks, or skip frames, while the writer queue is filling up')
+    argparser.add_argument(
+        '--max-tick-delay',
+        default=MAX_TICK_DELAY,
+        type=float,
+        help='longest delay of a tick in seconds before frames are skipped (default: %.1f)' % MAX_TICK_DELAY)
+    argparser.add_argument(
+        '--max-capture-every',
+        default=MAX_CAPTURE_EVERY,
+        type=int,
+        help='lowest capture rate of --pace, only every n-th frame stored (default: %d)' % MAX_CAPTURE_EVERY)
+    argparser.add_argument(
+        '--metrics',
+        default=None,
+        help='per-sensor stage timings summary file, .csv or .jsonl (default: no metrics)')
+    argparser.add_argument(
+        '--metrics-interval',
+        default=METRICS_INTERVAL,
+        type=float,
+        help='seconds between two metrics summaries (default: %.0f)' % METRICS_INTERVAL)
+    argparser.add_argument(
+        '--prometheus',
+        default=None,
+        help='also export the metrics to this Prometheus text file, e.g. for the node exporter textfile collector')
+
     args = argparser.parse_args()
 
     args.width, args.height = [int(x) for x in args.res.split('x')]
@@ -6,11 +6,28 @@ import cv2
 from PIL import Image
 import numpy as np
 from tqdm import *
-import matplotlib.pyplot as plt
 import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import sys
+
+# the size parser is shared with the episode store at the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from episode_store import parse_size
 
 BLOCK_SIZE = 7
 SEARCH_BLOCK_SIZE = 56
+SGM_P1 = 8
+SGM_P2 = 64
+SGM_DIRECTIONS = 8
+SGM_CHUNK_ROWS = 256
+PYRAMID_LEVELS = 2
+PYRAMID_REFINE_RADIUS = 2
+CENSUS_WINDOW = 5
+CONSISTENCY_TOLERANCE = 1
+MAX_MEM = '2G'
 
 
 def sum_of_abs_diff(pixel_vals_1, pixel_vals_2):
@@ -46,15 +63,155 @@ def compare_blocks(y, x, block_left, right_array, block_size=5):
     return min_index
 
 
-def get_disparity_map(left_img, right_img):
+def to_gray_array(img):
+    return cv2.cvtColor(img, cv2.COLOR_RGB2GRAY).astype(int)
 
-    left_array = cv2.cvtColor(left_img, cv2.COLOR_RGB2GRAY)
-    right_array = cv2.cvtColor(right_img, cv2.COLOR_RGB2GRAY)
 
-    left_array = left_array.astype(int)
-    right_array = right_array.astype(int)
-    if left_array.shape != right_array.shape:
-        raise "Left-Right image shape mismatch!"
+def cost_dtype(block_size=BLOCK_SIZE, max_pixel_cost=255):
+    # the largest possible cost of a block is block_size^2 * max_pixel_cost, int16 is enough for small blocks
+    if block_size * block_size * max_pixel_cost < np.iinfo(np.int16).max:
+        return np.int16
+    return np.int32
+
+
+def census_bits(window=CENSUS_WINDOW):
+    return window * window - 1
+
+
+def census_transform(gray, window=CENSUS_WINDOW):
+    # one bit per neighbour in the window (neighbour darker than the centre), packed into a uint32/uint64 word
+    bits = census_bits(window)
+    if window % 2 == 0 or bits > 64:
+        raise ValueError("census window must be odd and at most 7x7")
+    dtype = np.uint32 if bits <= 32 else np.uint64
+
+    radius = window // 2
+    h, w = gray.shape
+    padded = cv2.copyMakeBorder(gray.astype(np.uint8), radius, radius, radius, radius, cv2.BORDER_REPLICATE)
+    census = np.zeros((h, w), dtype=dtype)
+    for dy in range(window):
+        for dx in range(window):
+            if dy == radius and dx == radius:
+                continue
+            census <<= dtype(1)
+            census |= (padded[dy:dy + h, dx:dx + w] < gray).astype(dtype)
+
+    return census
+
+
+if hasattr(np, 'bitwise_count'):
+    popcount = np.bitwise_count
+else:
+    POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+    def popcount(values):
+        bytes_view = values.view(np.uint8).reshape(values.shape + (values.itemsize,))
+        return POPCOUNT_TABLE[bytes_view].sum(axis=-1, dtype=np.uint8)
+
+
+def hamming_distance(census_1, census_2):
+    return popcount(census_1 ^ census_2).astype(np.uint8)
+
+
+def box_sum(values, block_size=BLOCK_SIZE):
+    # un-normalized box filter anchored at the top-left, so sums[y, x] covers values[y:y+block_size, x:x+block_size]
+    # rows/columns whose window leaves the image are padded with zeros and must not be used
+    return cv2.boxFilter(values, cv2.CV_32S, (block_size, block_size), anchor=(0, 0),
+                         normalize=False, borderType=cv2.BORDER_CONSTANT)
+
+
+def matching_images(left_array, right_array, matching_cost='sad'):
+    # per-pixel representation the cost is computed on, and the cost of one pixel pair
+    if matching_cost == 'census':
+        return census_transform(left_array), census_transform(right_array), hamming_distance, census_bits()
+    elif matching_cost == 'sad':
+        return left_array.astype(np.uint8), right_array.astype(np.uint8), cv2.absdiff, 255
+    raise ValueError("Unknown matching cost %s" % matching_cost)
+
+
+def fill_cost_volume(cost_volume, left_array, right_array, pixel_cost, y_start=0, x_start=0,
+                     block_size=BLOCK_SIZE, search_block_size=SEARCH_BLOCK_SIZE, truncated_cost=-1,
+                     offsets=None):
+    """Fill cost_volume (D, tile_h, tile_w) with the costs of the pixels [y_start, y_start + tile_h) x
+    [x_start, x_start + tile_w) of the full-size matching images, for the D given offsets
+    (all of [-search_block_size, search_block_size) by default).
+
+    The tile reads a halo of block_size - 1 rows and columns past its end, and every mask is taken
+    in image coordinates, so any tiling gives exactly the values of the untiled volume.
+    """
+    d, tile_h, tile_w = cost_volume.shape
+    h, w = left_array.shape
+    invalid = np.iinfo(cost_volume.dtype).max
+    y_end = min(h, y_start + tile_h + block_size - 1)
+    x_end = min(w, x_start + tile_w + block_size - 1)
+    pixel_costs = np.zeros((y_end - y_start, x_end - x_start), dtype=np.uint8)
+    if offsets is None:
+        offsets = range(-search_block_size, search_block_size)
+
+    for k, offset in enumerate(offsets):
+        plane = cost_volume[k]
+        plane.fill(invalid)
+
+        # columns of the left image whose candidate x + offset falls inside the right image
+        x_min = max(x_start, -offset)
+        x_max = min(x_end, w - offset)
+        if x_min >= x_max:
+            continue
+
+        pixel_costs.fill(0)
+        pixel_costs[:, x_min - x_start:x_max - x_start] = pixel_cost(left_array[y_start:y_end, x_min:x_max],
+                                                                     right_array[y_start:y_end, x_min + offset:x_max + offset])
+        x_max = min(x_max, x_start + tile_w)
+        plane[:, x_min - x_start:x_max - x_start] = box_sum(pixel_costs, block_size)[:tile_h, x_min - x_start:x_max - x_start]
+
+        # right blocks cut by the image border make sum_of_abs_diff return -1, which always wins,
+        # census has no reference loop to follow and simply rejects them
+        truncated_min = max(x_min, w - block_size + 1 - offset)
+        if truncated_min < x_max:
+            plane[:, truncated_min - x_start:x_max - x_start] = truncated_cost
+
+
+def build_cost_volume(left_array, right_array, block_size=BLOCK_SIZE, search_block_size=SEARCH_BLOCK_SIZE,
+                      matching_cost='sad'):
+    """Block cost for every pixel and every candidate offset in [-search_block_size, search_block_size).
+
+    cost_volume[k, y, x] is the cost of matching the left block at (y, x) to the right block at
+    (y, x + k - search_block_size). With matching_cost='sad' it is the quantity compare_blocks
+    computes one block at a time, with 'census' it is the summed Hamming distance of census words.
+    """
+    left_array, right_array, pixel_cost, max_pixel_cost = matching_images(left_array, right_array, matching_cost)
+    h, w = left_array.shape
+    dtype = cost_dtype(block_size, max_pixel_cost)
+    cost_volume = np.empty((2 * search_block_size, h, w), dtype=dtype)
+    truncated_cost = -1 if matching_cost == 'sad' else np.iinfo(dtype).max
+    fill_cost_volume(cost_volume, left_array, right_array, pixel_cost, block_size=block_size,
+                     search_block_size=search_block_size, truncated_cost=truncated_cost)
+
+    return cost_volume
+
+
+def volume_argmin(cost_volume):
+    # argmin over the offset axis one plane at a time, np.argmin(axis=0) would copy the whole volume;
+    # the strict '<' keeps the first minimum like compare_blocks
+    best_cost = cost_volume[0].copy()
+    best = np.zeros(best_cost.shape, dtype=np.intp)
+    for k in range(1, cost_volume.shape[0]):
+        better = cost_volume[k] < best_cost
+        np.copyto(best_cost, cost_volume[k], where=better)
+        best[better] = k
+    return best, best_cost
+
+
+def winner_offsets(cost_volume, search_block_size=SEARCH_BLOCK_SIZE):
+    # signed offset x_right - x of the best candidate
+    return volume_argmin(cost_volume)[0] - search_block_size
+
+
+def winner_take_all(cost_volume, search_block_size=SEARCH_BLOCK_SIZE):
+    return np.abs(winner_offsets(cost_volume, search_block_size)).astype(np.float64)
+
+
+def get_disparity_map_reference(left_array, right_array):
     h, w = left_array.shape
     disparity_map = np.zeros((h, w))
     # Go over each pixel position
@@ -67,30 +224,523 @@ def get_disparity_map(left_img, right_img):
                                        block_size=BLOCK_SIZE)
             disparity_map[y, x] = abs(min_index[1] - x)
 
-    cv2.imwrite('disp.png', disparity_map)
+    return disparity_map
+
+
+def interior_cost_volume(left_array, right_array, matching_cost='sad'):
+    # view of the cost volume restricted to the pixels that get a disparity, [BLOCK_SIZE, size - BLOCK_SIZE)
+    h, w = left_array.shape
+    cost_volume = build_cost_volume(left_array, right_array, matching_cost=matching_cost)
+    return cost_volume[:, BLOCK_SIZE:h - BLOCK_SIZE, BLOCK_SIZE:w - BLOCK_SIZE]
+
+
+def get_disparity_map_vectorized(left_array, right_array, matching_cost='sad'):
+    h, w = left_array.shape
+    disparity_map = np.zeros((h, w))
+    disparity_map[BLOCK_SIZE:h - BLOCK_SIZE, BLOCK_SIZE:w - BLOCK_SIZE] = \
+        winner_take_all(interior_cost_volume(left_array, right_array, matching_cost))
 
     return disparity_map
 
 
-if __name__ == '__main__':
-    # loading the images
-    left_img = cv2.cvtColor(cv2.imread("img_l.png"), cv2.COLOR_BGR2RGB)
-    right_img = cv2.cvtColor(cv2.imread("img_r.png"), cv2.COLOR_BGR2RGB)
+def tile_shape(h, w, disparities, itemsize, budget):
+    # bytes per tile pixel: the cost buffer plus the argmin/winner arrays and per-offset temporaries
+    tile_pixels = budget // (disparities * itemsize + 32)
+    if tile_pixels < BLOCK_SIZE * BLOCK_SIZE:
+        raise ValueError("Memory budget too small for a single tile")
+    tile_w = min(w, max(BLOCK_SIZE, int(np.sqrt(tile_pixels))))
+    tile_h = min(h, tile_pixels // tile_w)
+    return tile_h, tile_w
+
+
+def get_disparity_map_tiled(left_array, right_array, matching_cost='sad', max_mem=MAX_MEM):
+    h, w = left_array.shape
+    disparity_map = np.zeros((h, w))
+    resident = left_array.nbytes + right_array.nbytes + disparity_map.nbytes
+    left_array, right_array, pixel_cost, max_pixel_cost = matching_images(left_array, right_array, matching_cost)
+
+    # the full-size images and the output stay resident, the rest of the budget goes to the tile buffer
+    dtype = np.dtype(cost_dtype(BLOCK_SIZE, max_pixel_cost))
+    resident += left_array.nbytes + right_array.nbytes
+    tile_h, tile_w = tile_shape(h - 2 * BLOCK_SIZE, w - 2 * BLOCK_SIZE, 2 * SEARCH_BLOCK_SIZE, dtype.itemsize,
+                                parse_size(max_mem) - resident)
+    buffer = np.empty((2 * SEARCH_BLOCK_SIZE, tile_h, tile_w), dtype=dtype)
+    truncated_cost = -1 if matching_cost == 'sad' else np.iinfo(dtype).max
+
+    tiles = [(y, x) for y in range(BLOCK_SIZE, h - BLOCK_SIZE, tile_h) for x in range(BLOCK_SIZE, w - BLOCK_SIZE, tile_w)]
+    for y_start, x_start in tqdm(tiles):
+        y_end = min(h - BLOCK_SIZE, y_start + tile_h)
+        x_end = min(w - BLOCK_SIZE, x_start + tile_w)
+        cost_volume = buffer[:, :y_end - y_start, :x_end - x_start]
+        fill_cost_volume(cost_volume, left_array, right_array, pixel_cost, y_start, x_start,
+                         truncated_cost=truncated_cost)
+        disparity_map[y_start:y_end, x_start:x_end] = winner_take_all(cost_volume)
+
+    return disparity_map
+
+
+def match_band_rows(shms, shape, y_start, y_end):
+    left_array = np.ndarray(shape, dtype=np.uint8, buffer=shms[0].buf)
+    right_array = np.ndarray(shape, dtype=np.uint8, buffer=shms[1].buf)
+    disparity_map = np.ndarray(shape, dtype=np.float64, buffer=shms[2].buf)
+
+    # a block anchored at row y reads rows y..y+BLOCK_SIZE-1, so each band overlaps the next by BLOCK_SIZE rows
+    w = shape[1]
+    band_end = min(shape[0], y_end + BLOCK_SIZE)
+    cost_volume = build_cost_volume(left_array[y_start:band_end], right_array[y_start:band_end])
+    disparity_map[y_start:y_end, BLOCK_SIZE:w - BLOCK_SIZE] = \
+        winner_take_all(cost_volume)[:y_end - y_start, BLOCK_SIZE:w - BLOCK_SIZE]
+
+
+def match_band(band):
+    # runs in a worker process: attach to the shared images and fill output rows [y_start, y_end)
+    names, shape, y_start, y_end = band
+    shms = [shared_memory.SharedMemory(name=name) for name in names]
+    try:
+        match_band_rows(shms, shape, y_start, y_end)
+    finally:
+        for shm in shms:
+            shm.close()
+
+    return y_start, y_end
+
+
+def run_bands(shms, left_array, right_array, workers):
+    h, w = left_array.shape
+    np.ndarray((h, w), dtype=np.uint8, buffer=shms[0].buf)[:] = left_array
+    np.ndarray((h, w), dtype=np.uint8, buffer=shms[1].buf)[:] = right_array
+    disparity_map = np.ndarray((h, w), dtype=np.float64, buffer=shms[2].buf)
+    disparity_map[:] = 0
+
+    names = [shm.name for shm in shms]
+    edges = np.linspace(BLOCK_SIZE, h - BLOCK_SIZE, workers + 1).astype(int)
+    bands = [(names, (h, w), y_start, y_end) for y_start, y_end in zip(edges[:-1], edges[1:]) if y_start < y_end]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for _ in tqdm(executor.map(match_band, bands), total=len(bands)):
+            pass
+
+    return disparity_map.copy()
+
+
+def get_disparity_map_parallel(left_array, right_array, workers=None):
+    workers = workers or os.cpu_count()
+    h, w = left_array.shape
+
+    # share the images with the workers instead of pickling them into every task
+    shms = [shared_memory.SharedMemory(create=True, size=h * w * np.dtype(dtype).itemsize)
+            for dtype in (np.uint8, np.uint8, np.float64)]
+    try:
+        disparity_map = run_bands(shms, left_array, right_array, workers)
+    finally:
+        for shm in shms:
+            shm.close()
+            shm.unlink()
+
+    return disparity_map
+
+
+def sgm_matching_cost(cost_volume, block_size=BLOCK_SIZE, max_pixel_cost=255):
+    # in-place rescaling of the block costs to 0..255 (the mean absolute difference for SAD)
+    # so the path costs of all directions can be summed in int16 without overflowing
+    invalid = np.iinfo(cost_volume.dtype).max
+    scale = max(1, int(np.ceil(block_size * block_size * max_pixel_cost / 255)))
+    for plane in cost_volume:
+        out_of_range = (plane == invalid) | (plane < 0)
+        plane //= scale
+        plane[out_of_range] = 255
+    return cost_volume.astype(np.int16, copy=False)
+
+
+def aggregate_scanlines(cost_volume, aggregated, dy, dx, p1=SGM_P1, p2=SGM_P2):
+    # walk the rows in the order of dy, every step is vectorized over a full row and all disparities
+    h, w = cost_volume.shape[1:]
+    rows = range(h) if dy > 0 else range(h - 1, -1, -1)
+    previous = None
+    for y in rows:
+        path_cost = cost_volume[:, y, :].copy()
+        if previous is not None:
+            # predecessor of pixel x is x - dx on the previous row, paths entering from the side restart
+            if dx > 0:
+                src, dst = previous[:, :-1], slice(1, w)
+            elif dx < 0:
+                src, dst = previous[:, 1:], slice(0, w - 1)
+            else:
+                src, dst = previous, slice(0, w)
 
-    disparity_map = get_disparity_map(left_img, right_img)
+            src_min = src.min(axis=0)
+            best = np.minimum(src, src_min + p2)
+            best[1:] = np.minimum(best[1:], src[:-1] + p1)
+            best[:-1] = np.minimum(best[:-1], src[1:] + p1)
+            path_cost[:, dst] += best - src_min
 
-    plt.style.use('seaborn-white')
+        aggregated[:, y, :] += path_cost
+        previous = path_cost
+
+
+def aggregate_direction(cost_volume, aggregated, dy, dx, p1=SGM_P1, p2=SGM_P2, chunk_rows=SGM_CHUNK_ROWS):
+    """Add the path cost L_r of one scanline direction (dy, dx) to aggregated, both (D, H, W) int16."""
+    if dy != 0:
+        aggregate_scanlines(cost_volume, aggregated, dy, dx, p1, p2)
+        return
+
+    # horizontal paths walk the columns; rows are independent, so work on contiguous transposed
+    # chunks of rows instead of striding through the whole volume column by column
+    h = cost_volume.shape[1]
+    for y_start in range(0, h, chunk_rows):
+        rows = slice(y_start, min(h, y_start + chunk_rows))
+        cost_chunk = np.ascontiguousarray(cost_volume[:, rows, :].transpose(0, 2, 1))
+        aggregated_chunk = np.zeros_like(cost_chunk)
+        aggregate_scanlines(cost_chunk, aggregated_chunk, dx, 0, p1, p2)
+        aggregated[:, rows, :] += aggregated_chunk.transpose(0, 2, 1)
+
+
+def sgm_cost_volume(left_array, right_array, p1=SGM_P1, p2=SGM_P2, directions=SGM_DIRECTIONS,
+                    matching_cost='sad'):
+    if directions not in (4, 8):
+        raise ValueError("SGM supports 4 or 8 directions")
+    if directions * (255 + p2) > np.iinfo(np.int16).max:
+        raise ValueError("P2 too large for int16 cost aggregation")
+
+    # only the interior has complete blocks, the border would feed garbage into the paths
+    max_pixel_cost = census_bits() if matching_cost == 'census' else 255
+    cost_volume = sgm_matching_cost(interior_cost_volume(left_array, right_array, matching_cost),
+                                    max_pixel_cost=max_pixel_cost)
+
+    scanlines = [(0, 1), (0, -1), (1, 0), (-1, 0)]
+    if directions == 8:
+        scanlines += [(1, 1), (1, -1), (-1, 1), (-1, -1)]
+
+    aggregated = np.zeros_like(cost_volume)
+    for dy, dx in tqdm(scanlines):
+        aggregate_direction(cost_volume, aggregated, dy, dx, p1, p2)
+
+    return aggregated
+
+
+def get_disparity_map_sgm(left_array, right_array, **sgm_options):
+    h, w = left_array.shape
+    disparity_map = np.zeros((h, w))
+    disparity_map[BLOCK_SIZE:h - BLOCK_SIZE, BLOCK_SIZE:w - BLOCK_SIZE] = \
+        winner_take_all(sgm_cost_volume(left_array, right_array, **sgm_options))
+
+    return disparity_map
+
+
+def search_around(left_array, right_array, offsets, radius=PYRAMID_REFINE_RADIUS, block_size=BLOCK_SIZE,
+                  search_block_size=None):
+    """Search offsets + [-radius, radius] around a per-pixel estimate, returns the best offsets and their costs.
+
+    Each pixel of the shifted right image uses its own estimate, so a block straddling an estimate
+    edge mixes offsets, which is the usual approximation of a coarse-to-fine search. With search_block_size
+    the candidates are kept inside [-search_block_size, search_block_size). Pixels without a single valid
+    candidate keep their estimate with the int32 maximum as cost.
+    """
+    h, w = left_array.shape
+    left_array = left_array.astype(np.uint8)
+    right_array = right_array.astype(np.uint8)
+    rows = np.arange(h)[:, None]
+    columns = np.arange(w)[None, :]
+
+    best_cost = np.full((h, w), np.iinfo(np.int32).max, dtype=np.int32)
+    best_offsets = offsets.copy()
+    for delta in range(-radius, radius + 1):
+        candidate = offsets + delta
+        if search_block_size is not None:
+            candidate = np.clip(candidate, -search_block_size, search_block_size - 1)
+        x_right = columns + candidate
+        shifted = right_array[rows, np.clip(x_right, 0, w - 1)]
+        cost = box_sum(cv2.absdiff(left_array, shifted), block_size)
+
+        # only full right blocks inside the image are valid candidates
+        valid = (x_right >= 0) & (x_right <= w - block_size)
+        better = valid & (cost < best_cost)
+        best_cost[better] = cost[better]
+        best_offsets[better] = candidate[better]
+
+    return best_offsets, best_cost
+
+
+def refine_offsets(left_array, right_array, offsets, radius=PYRAMID_REFINE_RADIUS, block_size=BLOCK_SIZE):
+    # best offsets within offsets + [-radius, radius]
+    return search_around(left_array, right_array, offsets, radius, block_size)[0]
+
+
+def get_disparity_map_pyramid(left_array, right_array, levels=PYRAMID_LEVELS, radius=PYRAMID_REFINE_RADIUS,
+                              search_block_size=SEARCH_BLOCK_SIZE):
+    h, w = left_array.shape
+    left_pyramid = [left_array.astype(np.uint8)]
+    right_pyramid = [right_array.astype(np.uint8)]
+    for _ in range(levels):
+        left_pyramid.append(cv2.pyrDown(left_pyramid[-1]))
+        right_pyramid.append(cv2.pyrDown(right_pyramid[-1]))
+
+    # full search on the coarsest level, where the search range shrinks by 2^levels
+    coarse_search = int(np.ceil(search_block_size / 2 ** levels))
+    cost_volume = build_cost_volume(left_pyramid[-1], right_pyramid[-1], search_block_size=coarse_search)
+    cost_volume[cost_volume < 0] = np.iinfo(cost_volume.dtype).max
+    offsets = winner_offsets(cost_volume, coarse_search)
+
+    # upsample the estimate and refine it in a small window on every finer level
+    for level in range(levels - 1, -1, -1):
+        level_h, level_w = left_pyramid[level].shape
+        offsets = 2 * cv2.resize(offsets.astype(np.int32), (level_w, level_h), interpolation=cv2.INTER_NEAREST)
+        offsets = refine_offsets(left_pyramid[level], right_pyramid[level], offsets, radius)
+
+    disparity_map = np.zeros((h, w))
+    disparity_map[BLOCK_SIZE:h - BLOCK_SIZE, BLOCK_SIZE:w - BLOCK_SIZE] = \
+        np.abs(offsets[BLOCK_SIZE:h - BLOCK_SIZE, BLOCK_SIZE:w - BLOCK_SIZE])
+
+    return disparity_map
+
+
+def right_winner_offsets(cost_volume, search_block_size=SEARCH_BLOCK_SIZE):
+    # right-to-left pass over the same volume: right pixel x_right is matched by left pixel x_right - offset
+    d, h, w = cost_volume.shape
+    invalid = np.iinfo(cost_volume.dtype).max
+    best_cost = np.full((h, w), invalid, dtype=cost_volume.dtype)
+    best_offsets = np.zeros((h, w), dtype=int)
+    shifted = np.empty((h, w), dtype=cost_volume.dtype)
+    for k in range(d):
+        offset = k - search_block_size
+        x_min = max(0, offset)
+        x_max = min(w, w + offset)
+        shifted.fill(invalid)
+        if x_min < x_max:
+            shifted[:, x_min:x_max] = cost_volume[k, :, x_min - offset:x_max - offset]
+        better = shifted < best_cost
+        best_cost[better] = shifted[better]
+        best_offsets[better] = offset
+
+    return best_offsets
+
+
+def refine_disparity(cost_volume, search_block_size=SEARCH_BLOCK_SIZE, tolerance=CONSISTENCY_TOLERANCE):
+    """Sub-pixel disparity and validity mask of a (D, H, W) cost volume.
+
+    The integer winner is refined by fitting a parabola through its cost and the costs of the
+    neighbouring offsets. A pixel is valid when it has a finite cost and the right-to-left winner
+    at its match points back to it within tolerance pixels. Invalid pixels get disparity 0.
+    """
+    invalid = np.iinfo(cost_volume.dtype).max
+    # truncated blocks are a quirk of the reference loop, here they are simply rejected
+    for plane in cost_volume:
+        plane[plane < 0] = invalid
+
+    d, h, w = cost_volume.shape
+    best, cost = volume_argmin(cost_volume)
+    cost = cost.astype(np.float32)
+    cost_before = np.take_along_axis(cost_volume, np.maximum(best - 1, 0)[None], axis=0)[0].astype(np.float32)
+    cost_after = np.take_along_axis(cost_volume, np.minimum(best + 1, d - 1)[None], axis=0)[0].astype(np.float32)
+
+    curvature = cost_before - 2 * cost + cost_after
+    has_parabola = (best > 0) & (best < d - 1) & (cost_before != invalid) & (cost_after != invalid) & (curvature > 0)
+    sub_pixel = np.zeros((h, w), dtype=np.float32)
+    np.divide(cost_before - cost_after, 2 * curvature, out=sub_pixel, where=has_parabola)
+
+    offsets = best - search_block_size
+    x_right = np.arange(w)[None, :] + offsets
+    inside = (x_right >= 0) & (x_right < w)
+    right_offsets = right_winner_offsets(cost_volume, search_block_size)
+    matched_back = right_offsets[np.arange(h)[:, None], np.clip(x_right, 0, w - 1)]
+    valid = inside & (cost != invalid) & (np.abs(matched_back - offsets) <= tolerance)
+
+    disparity = np.abs(offsets + sub_pixel).astype(np.float32)
+    disparity[~valid] = 0
+
+    return disparity, valid
+
+
+MATCHING_MODES = {
+    'vectorized': get_disparity_map_vectorized,
+    'reference': get_disparity_map_reference,
+    'parallel': get_disparity_map_parallel,
+    'sgm': get_disparity_map_sgm,
+    'pyramid': get_disparity_map_pyramid,
+    'tiled': get_disparity_map_tiled,
+}
+
+# modes that expose their cost volume over the interior and can be refined by refine_disparity
+COST_VOLUME_MODES = {
+    'vectorized': interior_cost_volume,
+    'sgm': sgm_cost_volume,
+}
+
+
+def get_refined_disparity_map(left_array, right_array, mode='vectorized', tolerance=CONSISTENCY_TOLERANCE,
+                              **mode_options):
+    if mode not in COST_VOLUME_MODES:
+        raise ValueError("Mode %s has no cost volume to refine" % mode)
+
+    h, w = left_array.shape
+    disparity_map = np.zeros((h, w), dtype=np.float32)
+    valid = np.zeros((h, w), dtype=bool)
+    cost_volume = COST_VOLUME_MODES[mode](left_array, right_array, **mode_options)
+    interior = (slice(BLOCK_SIZE, h - BLOCK_SIZE), slice(BLOCK_SIZE, w - BLOCK_SIZE))
+    disparity_map[interior], valid[interior] = refine_disparity(cost_volume, tolerance=tolerance)
+
+    return disparity_map, valid
+
+
+def save_disparity(path, disparity_map, valid=None):
+    # float32 disparity and validity mask in one compressed archive, no 8-bit truncation
+    if valid is None:
+        valid = np.zeros(disparity_map.shape, dtype=bool)
+        valid[BLOCK_SIZE:-BLOCK_SIZE, BLOCK_SIZE:-BLOCK_SIZE] = True
+    np.savez_compressed(path, disparity=disparity_map.astype(np.float32), valid=valid)
+
+
+def load_disparity(path):
+    with np.load(path) as data:
+        return data['disparity'], data['valid']
+
+
+def get_disparity_map(left_img, right_img, mode='vectorized', refine=False, output_path='disp.npz', **mode_options):
+
+    left_array = to_gray_array(left_img)
+    right_array = to_gray_array(right_img)
+    if left_array.shape != right_array.shape:
+        raise ValueError("Left-Right image shape mismatch!")
+
+    if refine:
+        disparity_map, valid = get_refined_disparity_map(left_array, right_array, mode, **mode_options)
+    else:
+        disparity_map = MATCHING_MODES[mode](left_array, right_array, **mode_options)
+        valid = None
+
+    if output_path:
+        save_disparity(output_path, disparity_map, valid)
+
+    return disparity_map
+
+
+def add_matcher_arguments(argparser):
+    argparser.add_argument(
+        '--mode',
+        default='vectorized',
+        choices=sorted(MATCHING_MODES),
+        help='matching engine, "reference" is the original per-pixel loop (default: vectorized)')
+    argparser.add_argument(
+        '--cost',
+        default='sad',
+        choices=['sad', 'census'],
+        help='matching cost of the vectorized, tiled and sgm modes (default: sad)')
+    argparser.add_argument(
+        '--workers',
+        default=os.cpu_count(),
+        type=int,
+        help='number of worker processes for the parallel mode (default: all cores)')
+    argparser.add_argument(
+        '--p1',
+        default=SGM_P1,
+        type=int,
+        help='SGM penalty for a disparity change of one pixel (default: %d)' % SGM_P1)
+    argparser.add_argument(
+        '--p2',
+        default=SGM_P2,
+        type=int,
+        help='SGM penalty for larger disparity jumps (default: %d)' % SGM_P2)
+    argparser.add_argument(
+        '--directions',
+        default=SGM_DIRECTIONS,
+        type=int,
+        choices=[4, 8],
+        help='number of SGM aggregation directions (default: %d)' % SGM_DIRECTIONS)
+    argparser.add_argument(
+        '--levels',
+        default=PYRAMID_LEVELS,
+        type=int,
+        help='pyramid levels below full resolution, 2 searches at 1/4 scale (default: %d)' % PYRAMID_LEVELS)
+    argparser.add_argument(
+        '--radius',
+        default=PYRAMID_REFINE_RADIUS,
+        type=int,
+        help='pyramid refinement window around the upsampled estimate (default: %d)' % PYRAMID_REFINE_RADIUS)
+    argparser.add_argument(
+        '--max-disparity',
+        default=SEARCH_BLOCK_SIZE,
+        type=int,
+        help='pyramid search range at full resolution (default: %d)' % SEARCH_BLOCK_SIZE)
+    argparser.add_argument(
+        '--max-mem',
+        default=MAX_MEM,
+        help='memory budget of the tiled mode, e.g. 512M or 2G (default: %s)' % MAX_MEM)
+    argparser.add_argument(
+        '--refine',
+        action='store_true',
+        help='sub-pixel refinement and left-right consistency check (vectorized and sgm modes)')
+    argparser.add_argument(
+        '--tolerance',
+        default=CONSISTENCY_TOLERANCE,
+        type=int,
+        help='left-right consistency tolerance in pixels (default: %d)' % CONSISTENCY_TOLERANCE)
+
+
+def matcher_options(args):
+    # get_disparity_map keyword arguments for the parsed matcher flags
+    mode_options = {}
+    if args.mode in ('vectorized', 'tiled', 'sgm'):
+        mode_options['matching_cost'] = args.cost
+    if args.mode == 'tiled':
+        mode_options['max_mem'] = args.max_mem
+    if args.mode == 'parallel':
+        mode_options['workers'] = args.workers
+    elif args.mode == 'sgm':
+        mode_options.update(p1=args.p1, p2=args.p2, directions=args.directions)
+    elif args.mode == 'pyramid':
+        mode_options.update(levels=args.levels, radius=args.radius, search_block_size=args.max_disparity)
+    if args.refine:
+        mode_options.update(refine=True, tolerance=args.tolerance)
+
+    return mode_options
+
+
+def plot_disparity(left_img, right_img, disparity_map, path='plot.jpg'):
+    # matplotlib is only imported when a plot is asked for, batches never pay for it
+    import matplotlib.pyplot as plt
+
+    # matplotlib 3.6 renamed the seaborn styles
+    plt.style.use('seaborn-v0_8-white' if 'seaborn-v0_8-white' in plt.style.available else 'seaborn-white')
     plotting_data = [left_img, right_img, disparity_map]
-    plotting_titles = ['left image', 'right image', 'disparity map']
     fig, axs = plt.subplots(nrows=1, ncols=3, figsize=(12, 4))
     for i, ax in enumerate(axs.flatten()):
         plt.sca(ax)
         plt.imshow(plotting_data[i])
         plt.axis('off')
-        # plt.title(plotting_titles[i])
 
     plt.tight_layout()
     # plt.suptitle('Disparity measurements')
-    plt.savefig('plot.jpg')
+    plt.savefig(path)
     plt.show()
 
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(
+        description='Manual block matching disparity')
+    argparser.add_argument(
+        '--left',
+        default='img_l.png',
+        help='left image (default: img_l.png)')
+    argparser.add_argument(
+        '--right',
+        default='img_r.png',
+        help='right image (default: img_r.png)')
+    argparser.add_argument(
+        '--output',
+        default='disp.npz',
+        help='float disparity and validity mask archive (default: disp.npz)')
+    argparser.add_argument(
+        '--plot',
+        action='store_true',
+        help='show the images next to the disparity map and save them to plot.jpg')
+    add_matcher_arguments(argparser)
+    args = argparser.parse_args()
+
+    # loading the images
+    left_img = cv2.cvtColor(cv2.imread(args.left), cv2.COLOR_BGR2RGB)
+    right_img = cv2.cvtColor(cv2.imread(args.right), cv2.COLOR_BGR2RGB)
+
+    disparity_map = get_disparity_map(left_img, right_img, mode=args.mode, output_path=args.output,
+                                      **matcher_options(args))
+
+    if args.plot:
+        plot_disparity(left_img, right_img, disparity_map)
@@ -0,0 +1,199 @@
+## The following code is a part of disparity measurements section at the Carla simulator research blog - https://carlasimblog.wordpress.com/2023/09/20/disparity-in-stereo-cameras-measuring-understanding-and-its-crucial-role/.
+## Feel free to show your support via requested, suggestions and interesting ideas for future research material.
+
+## Sequence mode for the block matcher: after the first frame every pair is only searched in a narrow window
+## around the disparity of the previous frame, pixels the narrow search is not confident about get a full search.
+
+import argparse
+import glob
+import os
+import time
+
+import cv2
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from manual_block_matching import (BLOCK_SIZE, SEARCH_BLOCK_SIZE, cost_dtype, fill_cost_volume, matching_images,
+                                   save_disparity, search_around, to_gray_array, volume_argmin)
+
+SEQUENCE_RADIUS = 2
+# a pixel falls back to the full search when the mean absolute difference of its best block is above
+# CONFIDENCE_THRESHOLD and the block cost grew by more than COST_GROWTH since the previous frame
+CONFIDENCE_THRESHOLD = 12
+COST_GROWTH = 1.5
+
+
+def list_stereo_sequence(directory):
+    # ordered (name, left path, right path) for every <name>_l.png with a matching <name>_r.png
+    pairs = []
+    for left_path in sorted(glob.glob(os.path.join(directory, '*_l.png'))):
+        right_path = left_path[:-len('_l.png')] + '_r.png'
+        if os.path.exists(right_path):
+            pairs.append((os.path.basename(left_path)[:-len('_l.png')], left_path, right_path))
+    return pairs
+
+
+def search_tile(left_array, right_array, y_start, y_end, x_start, x_end, offsets):
+    # exact costs of one tile for the given offsets, truncated right blocks are rejected instead of winning
+    dtype = cost_dtype()
+    cost_volume = np.empty((len(offsets), y_end - y_start, x_end - x_start), dtype=dtype)
+    fill_cost_volume(cost_volume, left_array, right_array, cv2.absdiff, y_start, x_start,
+                     truncated_cost=np.iinfo(dtype).max, offsets=offsets)
+    return cost_volume
+
+
+def full_search(left_array, right_array, y_start, y_end, x_start, x_end):
+    cost_volume = search_tile(left_array, right_array, y_start, y_end, x_start, x_end,
+                              range(-SEARCH_BLOCK_SIZE, SEARCH_BLOCK_SIZE))
+    best, best_cost = volume_argmin(cost_volume)
+    return best - SEARCH_BLOCK_SIZE, best_cost
+
+
+def point_search(left_array, right_array, ys, xs):
+    # full search for scattered pixels: their blocks and right strips are gathered once, and the costs of
+    # all 2 * SEARCH_BLOCK_SIZE offsets are accumulated one block column at a time
+    h, w = left_array.shape
+    padded = cv2.copyMakeBorder(right_array, 0, 0, SEARCH_BLOCK_SIZE, SEARCH_BLOCK_SIZE, cv2.BORDER_REPLICATE)
+    strips = sliding_window_view(padded, (BLOCK_SIZE, 2 * SEARCH_BLOCK_SIZE + BLOCK_SIZE - 1))[ys, xs]
+    blocks = sliding_window_view(left_array, (BLOCK_SIZE, BLOCK_SIZE))[ys, xs]
+    cost = np.zeros((len(ys) * BLOCK_SIZE, 2 * SEARCH_BLOCK_SIZE), dtype=np.uint16)
+    for j in range(BLOCK_SIZE):
+        column = np.repeat(blocks[:, :, j].reshape(-1, 1), 2 * SEARCH_BLOCK_SIZE, axis=1)
+        window = np.ascontiguousarray(strips[:, :, j:j + 2 * SEARCH_BLOCK_SIZE]).reshape(column.shape)
+        cost += cv2.absdiff(column, window)
+    cost = cost.reshape(len(ys), BLOCK_SIZE, -1).sum(axis=1, dtype=np.int32)
+
+    candidates = xs[:, None] + np.arange(-SEARCH_BLOCK_SIZE, SEARCH_BLOCK_SIZE)
+    cost[(candidates < 0) | (candidates + BLOCK_SIZE > w)] = np.iinfo(cost_dtype()).max
+    best = cost.argmin(axis=1)
+    best_cost = cost[np.arange(len(ys)), best]
+    return best - SEARCH_BLOCK_SIZE, best_cost
+
+
+def warp_prior(offsets, ego_motion):
+    # ego_motion = (dx, dy, scale): image shift in pixels and zoom about the image centre between two frames,
+    # moving forward zooms the scene and grows every disparity by the same factor
+    dx, dy, scale = ego_motion
+    h, w = offsets.shape
+    warp = np.array([[scale, 0, (1 - scale) * w / 2 + dx],
+                     [0, scale, (1 - scale) * h / 2 + dy]], dtype=np.float64)
+    warped = cv2.warpAffine(offsets.astype(np.float32), warp, (w, h), flags=cv2.INTER_NEAREST,
+                            borderMode=cv2.BORDER_REPLICATE)
+    return np.round(warped * scale).astype(np.int32)
+
+
+def match_with_prior(left_array, right_array, prior, reference_cost, radius=SEQUENCE_RADIUS,
+                     threshold=CONFIDENCE_THRESHOLD):
+    """Offsets of one frame searched within prior +- radius, with a full search where that is not confident.
+
+    A pixel is trusted when its best block is below the threshold, or not much worse than its best block
+    in the previous frame: occluded pixels and blocks over slanted surfaces never match perfectly and
+    would otherwise fall back on every frame. reference_cost holds the previous costs and is updated in
+    place. Returns the signed offsets and the fallback pixel fraction.
+    """
+    h, w = left_array.shape
+    left_array, right_array, _, _ = matching_images(left_array, right_array)
+    # 2 * radius + 1 shifted absdiff and box filter passes over the whole image, each pixel gathers its own
+    # prior + k from the right image, the candidates stay inside the full search range
+    searched, cost = search_around(left_array, right_array, prior, radius, search_block_size=SEARCH_BLOCK_SIZE)
+    # a block over a one pixel step of a smooth prior (a slanted surface) measures a shift of most of its pixels,
+    # it is applied to their median prior instead of the prior of the block's corner pixel, which would bias it
+    # by one. blocks over larger steps are over object edges and keep the corner pixel's prior
+    shifted_prior = (prior + SEARCH_BLOCK_SIZE).astype(np.uint8)
+    kernel = np.ones((BLOCK_SIZE, BLOCK_SIZE), dtype=np.uint8)
+    step = cv2.dilate(shifted_prior, kernel, anchor=(0, 0)) - cv2.erode(shifted_prior, kernel, anchor=(0, 0))
+    # medianBlur is centred, the block of pixel (y, x) is centred on (y + BLOCK_SIZE // 2, x + BLOCK_SIZE // 2)
+    block_prior = np.roll(cv2.medianBlur(shifted_prior, BLOCK_SIZE), (-(BLOCK_SIZE // 2), -(BLOCK_SIZE // 2)),
+                          axis=(0, 1)).astype(np.int32) - SEARCH_BLOCK_SIZE
+    base = np.where(step <= 1, block_prior, prior)
+    interior = (slice(BLOCK_SIZE, h - BLOCK_SIZE), slice(BLOCK_SIZE, w - BLOCK_SIZE))
+    offsets = prior.copy()
+    offsets[interior] = np.clip(base[interior] + searched[interior] - prior[interior],
+                                -SEARCH_BLOCK_SIZE, SEARCH_BLOCK_SIZE - 1)
+
+    low_confidence = np.zeros((h, w), dtype=bool)
+    low_confidence[interior] = (cost[interior] > threshold * BLOCK_SIZE * BLOCK_SIZE) & \
+                               (cost[interior] > COST_GROWTH * reference_cost[interior])
+    reference_cost[interior] = cost[interior]
+
+    # low-confidence pixels are scattered along moving edges, they get one full search all together
+    ys, xs = np.nonzero(low_confidence)
+    offsets[ys, xs], reference_cost[ys, xs] = point_search(left_array, right_array, ys, xs)
+    return offsets, len(ys) / ((h - 2 * BLOCK_SIZE) * (w - 2 * BLOCK_SIZE))
+
+
+def get_disparity_sequence(pairs, radius=SEQUENCE_RADIUS, threshold=CONFIDENCE_THRESHOLD, ego_motion=None):
+    # generator over (name, disparity map, fraction of pixels that fell back to the full search)
+    offsets = None
+    for name, left_img, right_img in pairs:
+        left_array = to_gray_array(left_img)
+        right_array = to_gray_array(right_img)
+        if left_array.shape != right_array.shape:
+            raise ValueError("Left-Right image shape mismatch!")
+        h, w = left_array.shape
+
+        if offsets is None or offsets.shape != (h, w):
+            offsets = np.zeros((h, w), dtype=np.int32)
+            reference_cost = np.zeros((h, w), dtype=np.int32)
+            interior = (slice(BLOCK_SIZE, h - BLOCK_SIZE), slice(BLOCK_SIZE, w - BLOCK_SIZE))
+            offsets[interior], reference_cost[interior] = full_search(
+                *matching_images(left_array, right_array)[:2], BLOCK_SIZE, h - BLOCK_SIZE, BLOCK_SIZE, w - BLOCK_SIZE)
+            fallback = 1.0
+        else:
+            prior = warp_prior(offsets, ego_motion) if ego_motion is not None else offsets
+            # a median keeps object edges but drops isolated outliers that would widen the tile searches
+            prior = cv2.medianBlur(prior.astype(np.float32), 5).astype(np.int32)
+            prior = np.clip(prior, -SEARCH_BLOCK_SIZE, SEARCH_BLOCK_SIZE - 1)
+            offsets, fallback = match_with_prior(left_array, right_array, prior, reference_cost, radius, threshold)
+
+        disparity_map = np.zeros((h, w))
+        disparity_map[BLOCK_SIZE:h - BLOCK_SIZE, BLOCK_SIZE:w - BLOCK_SIZE] = \
+            np.abs(offsets[BLOCK_SIZE:h - BLOCK_SIZE, BLOCK_SIZE:w - BLOCK_SIZE])
+        yield name, disparity_map, fallback
+
+
+def read_pairs(paths):
+    for name, left_path, right_path in paths:
+        left_img = cv2.cvtColor(cv2.imread(left_path), cv2.COLOR_BGR2RGB)
+        right_img = cv2.cvtColor(cv2.imread(right_path), cv2.COLOR_BGR2RGB)
+        yield name, left_img, right_img
+
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(
+        description='Temporal block matching over an ordered stereo sequence')
+    argparser.add_argument(
+        'directory',
+        help='directory with ordered <name>_l.png / <name>_r.png frame pairs')
+    argparser.add_argument(
+        '--output-dir',
+        default=None,
+        help='where to write <name>_disp.npz (default: the input directory)')
+    argparser.add_argument(
+        '--radius',
+        default=SEQUENCE_RADIUS,
+        type=int,
+        help='search window around the previous disparity (default: %d)' % SEQUENCE_RADIUS)
+    argparser.add_argument(
+        '--threshold',
+        default=CONFIDENCE_THRESHOLD,
+        type=float,
+        help='mean absolute difference above which a pixel gets a full search (default: %d)' % CONFIDENCE_THRESHOLD)
+    argparser.add_argument(
+        '--ego-motion',
+        metavar='DX,DY,SCALE',
+        default=None,
+        help='per-frame image shift and zoom used to warp the previous disparity, e.g. 0,0,1.01')
+    args = argparser.parse_args()
+
+    ego_motion = [float(v) for v in args.ego_motion.split(',')] if args.ego_motion else None
+    output_dir = args.output_dir or args.directory
+    os.makedirs(output_dir, exist_ok=True)
+
+    pairs = read_pairs(list_stereo_sequence(args.directory))
+    t_start = time.perf_counter()
+    for name, disparity_map, fallback in get_disparity_sequence(pairs, args.radius, args.threshold, ego_motion):
+        t_end = time.perf_counter()
+        save_disparity(os.path.join(output_dir, '%s_disp.npz' % name), disparity_map)
+        print('%s: %.3fs, full search on %.1f%% of the pixels' % (name, t_end - t_start, 100 * fallback))
+        t_start = time.perf_counter()
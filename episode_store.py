@@ -0,0 +1,162 @@
+## The following code is a part of Sensors section at the Carla simulator research blog - https://carlasimblog.wordpress.com/2023/09/16/visualize-multiple-sensors/.
+## Feel free to show your support via requested, suggestions and interesting ideas for future research material.
+
+## Episode store: instead of one png per sensor and tick, raw frames are appended to large per-sensor chunk files.
+## A small csv index maps (frame id, sensor) to the chunk, offset, shape and dtype of every frame, so any frame can
+## be read back through a memory map without decoding anything. Running this file exports an episode to pngs.
+
+import argparse
+import csv
+import os
+import re
+import threading
+
+import cv2
+import numpy as np
+
+EPISODE_DIR = '_out/multiple_sensors/episode'
+CHUNK_SIZE = '1G'
+INDEX_FILE = 'index.csv'
+INDEX_FIELDS = ['frame', 'sensor', 'chunk', 'offset', 'shape', 'dtype']
+# file names of the png output, '%08d_<sensor>.png', the store keeps the same frame ids and sensor names
+PNG_NAME = re.compile(r'(\d+)_(\w+)\.png$')
+
+
+def parse_size(size):
+    # '512M', '2G', '1.5g', '512MB' or a plain number of bytes, shared by every size option of the repository
+    units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+    size = str(size).strip().upper().rstrip('B')
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(float(size))
+
+
+def chunk_name(sensor, chunk):
+    return '%s_%05d.bin' % (sensor, chunk)
+
+
+class EpisodeStore:
+    def __init__(self, directory=EPISODE_DIR, chunk_size=CHUNK_SIZE):
+        self.directory = directory
+        self.chunk_size = parse_size(chunk_size)
+        os.makedirs(directory, exist_ok=True)
+
+        # appending to an existing episode continues after its last chunk of every sensor
+        self.chunks = {}
+        for entry in read_index(directory):
+            self.chunks[entry['sensor']] = max(self.chunks.get(entry['sensor'], 0), entry['chunk'])
+        self.files = {}
+        self.lock = threading.Lock()
+        index_path = os.path.join(directory, INDEX_FILE)
+        new_index = not os.path.exists(index_path)
+        self.index_file = open(index_path, 'a', newline='')
+        self.index = csv.writer(self.index_file)
+        if new_index:
+            self.index.writerow(INDEX_FIELDS)
+
+    def chunk_file(self, sensor, nbytes):
+        # the open chunk of the sensor, a new one is started when the frame would not fit anymore
+        chunk_file = self.files.get(sensor)
+        if chunk_file is not None and chunk_file.tell() > 0 and chunk_file.tell() + nbytes > self.chunk_size:
+            chunk_file.close()
+            self.chunks[sensor] += 1
+            chunk_file = None
+        if chunk_file is None:
+            self.chunks.setdefault(sensor, 0)
+            chunk_file = open(os.path.join(self.directory, chunk_name(sensor, self.chunks[sensor])), 'ab')
+            self.files[sensor] = chunk_file
+        return chunk_file
+
+    def append(self, frame, sensor, array):
+        """Append one frame of a sensor, any array shape and dtype."""
+        array = np.ascontiguousarray(array)
+        with self.lock:
+            chunk_file = self.chunk_file(sensor, array.nbytes)
+            offset = chunk_file.tell()
+            chunk_file.write(array.data)
+            chunk_file.flush()
+            # the index line is only written once the frame is in the chunk, a crash never indexes missing data
+            self.index.writerow([frame, sensor, self.chunks[sensor], offset,
+                                 'x'.join(str(v) for v in array.shape), array.dtype.str])
+            self.index_file.flush()
+
+    def write(self, path, buffer, height, width):
+        # ImageWriter sink: the png path of the frame only gives its frame id and sensor name
+        match = PNG_NAME.search(os.path.basename(path))
+        if match is None:
+            raise ValueError("Cannot take a frame id and sensor from %s" % path)
+        frame, sensor = match.groups()
+        self.append(int(frame), sensor, np.frombuffer(buffer, dtype=np.uint8).reshape((height, width, 4)))
+
+    def close(self):
+        with self.lock:
+            for chunk_file in self.files.values():
+                chunk_file.close()
+            self.files = {}
+            self.index_file.close()
+
+
+def read_index(directory):
+    index_path = os.path.join(directory, INDEX_FILE)
+    if not os.path.exists(index_path):
+        return []
+    with open(index_path, newline='') as index_file:
+        return [{'frame': int(row['frame']), 'sensor': row['sensor'], 'chunk': int(row['chunk']),
+                 'offset': int(row['offset']), 'shape': tuple(int(v) for v in row['shape'].split('x')),
+                 'dtype': np.dtype(row['dtype'])}
+                for row in csv.DictReader(index_file)]
+
+
+class EpisodeReader:
+    def __init__(self, directory=EPISODE_DIR):
+        self.directory = directory
+        self.entries = {(entry['frame'], entry['sensor']): entry for entry in read_index(directory)}
+        self.maps = {}
+
+    def sensors(self):
+        return sorted({sensor for _, sensor in self.entries})
+
+    def frames(self, sensor=None):
+        return sorted({frame for frame, frame_sensor in self.entries if sensor is None or frame_sensor == sensor})
+
+    def read(self, frame, sensor):
+        """Read-only view of one frame straight from the memory-mapped chunk, nothing is copied."""
+        entry = self.entries[(frame, sensor)]
+        key = (sensor, entry['chunk'])
+        if key not in self.maps:
+            self.maps[key] = np.memmap(os.path.join(self.directory, chunk_name(*key)), dtype=np.uint8, mode='r')
+        nbytes = int(np.prod(entry['shape'])) * entry['dtype'].itemsize
+        data = self.maps[key][entry['offset']:entry['offset'] + nbytes]
+        return data.view(entry['dtype']).reshape(entry['shape'])
+
+
+def export_pngs(directory, output_dir, sensors=None):
+    # the files the png output would have written, '%08d_<sensor>.png' with the stored BGRA pixels
+    reader = EpisodeReader(directory)
+    os.makedirs(output_dir, exist_ok=True)
+    exported = 0
+    for frame, sensor in sorted(reader.entries):
+        if sensors and sensor not in sensors:
+            continue
+        cv2.imwrite(os.path.join(output_dir, '%08d_%s.png' % (frame, sensor)), reader.read(frame, sensor))
+        exported += 1
+    return exported
+
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(
+        description='Export an episode store back to one png per frame and sensor')
+    argparser.add_argument(
+        'episode',
+        help='episode directory written by the episode output of data_collection.py')
+    argparser.add_argument(
+        'output_dir',
+        help='where to write the %%08d_<sensor>.png files')
+    argparser.add_argument(
+        '--sensors',
+        default=None,
+        help='comma separated subset of the sensors to export (default: all)')
+    args = argparser.parse_args()
+
+    exported = export_pngs(args.episode, args.output_dir, args.sensors.split(',') if args.sensors else None)
+    print('%d frames exported to %s' % (exported, args.output_dir))
@@ -0,0 +1,97 @@
+## The following code is a part of Sensors section at the Carla simulator research blog - https://carlasimblog.wordpress.com/2023/09/16/visualize-multiple-sensors/.
+## Feel free to show your support via requested, suggestions and interesting ideas for future research material.
+
+## Shared-memory frame ring: fixed-size slots in one multiprocessing.shared_memory block, sized from the rig. A sensor
+## callback copies image.raw_data once into a free slot and only the slot index and a little metadata go through a
+## queue, the worker processes view the slot as a numpy array without copying. Pickling a 3840x2880 BGRA frame (44 MB)
+## through a multiprocessing.Queue instead costs several copies and a pipe transfer per frame.
+
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+FRAME_RING_SLOTS = 8
+
+
+def rig_slot_size(rig, resolution):
+    # bytes of the largest frame of the rig, the sensors without their own resolution use resolution (width, height)
+    return max(4 * width * height for width, height in (spec['resolution'] or resolution for spec in rig))
+
+
+class FrameRing:
+    def __init__(self, slots=FRAME_RING_SLOTS, slot_size=0):
+        """slots frames of at most slot_size bytes each, in one shared memory block owned by this process.
+
+        The ring is passed to worker processes as a Process or pool initializer argument, they attach to the
+        same block by its name. The slot flags, the semaphore counting the free slots and the queue of the
+        published frames are shared too, so a slot can be released by the process that consumed it.
+        """
+        self.slots = slots
+        self.slot_size = slot_size
+        self.memory = shared_memory.SharedMemory(create=True, size=slots * slot_size)
+        self.owner = True
+        self.available = multiprocessing.Semaphore(slots)
+        self.in_use = multiprocessing.Array('b', slots)
+        self.frames = multiprocessing.Queue()
+
+    def __getstate__(self):
+        return {'name': self.memory.name, 'slots': self.slots, 'slot_size': self.slot_size,
+                'available': self.available, 'in_use': self.in_use, 'frames': self.frames}
+
+    def __setstate__(self, state):
+        self.slots = state['slots']
+        self.slot_size = state['slot_size']
+        self.memory = shared_memory.SharedMemory(name=state['name'])
+        self.owner = False
+        self.available = state['available']
+        self.in_use = state['in_use']
+        self.frames = state['frames']
+
+    def acquire(self, timeout=None):
+        """A free slot, None when none got free within timeout seconds (0 does not wait)."""
+        if not self.available.acquire(timeout != 0, timeout or None):
+            return None
+        with self.in_use.get_lock():
+            slot = self.in_use[:].index(0)
+            self.in_use[slot] = 1
+        return slot
+
+    def release(self, slot):
+        with self.in_use.get_lock():
+            self.in_use[slot] = 0
+        self.available.release()
+
+    def view(self, slot, shape, dtype=np.uint8):
+        # the slot as an array, nothing is copied, valid until the slot is released
+        return np.ndarray(shape, dtype=dtype, buffer=self.memory.buf, offset=slot * self.slot_size)
+
+    def write(self, slot, buffer):
+        # the one copy of a frame, from the carla buffer straight into shared memory
+        data = np.frombuffer(buffer, dtype=np.uint8)
+        if data.nbytes > self.slot_size:
+            raise ValueError("Frame of %d bytes does not fit the %d byte slots" % (data.nbytes, self.slot_size))
+        self.view(slot, data.shape)[...] = data
+
+    def put(self, buffer, shape, meta=None, timeout=None):
+        """Copy a frame into a free slot and publish it with its shape and metadata.
+
+        Returns the slot, or None when no slot got free within timeout and the frame was not published.
+        """
+        slot = self.acquire(timeout)
+        if slot is None:
+            return None
+        self.write(slot, buffer)
+        self.frames.put((slot, tuple(shape), meta))
+        return slot
+
+    def get(self, timeout=None):
+        """Next published frame as (slot, array view, meta), the consumer calls release(slot) when done with it."""
+        slot, shape, meta = self.frames.get(timeout=timeout)
+        return slot, self.view(slot, shape), meta
+
+    def close(self):
+        # the views of the slots must be gone before the memory can be closed
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
@@ -0,0 +1,280 @@
+## The following code is a part of Sensors section at the Carla simulator research blog - https://carlasimblog.wordpress.com/2023/09/16/visualize-multiple-sensors/.
+## Feel free to show your support via requested, suggestions and interesting ideas for future research material.
+
+## Asynchronous image writer for the sensor callbacks: a callback only puts the raw BGRA buffer of an image on a
+## bounded queue, and a pool of encoder threads (or processes) writes the png files. Encoding a 4K png takes far
+## longer than a tick, writing it inside the callback stalls the sensor thread and in sync mode world.tick() too.
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+from frame_ring import FrameRing
+from sensors.depth_decoder import DepthDecoder
+
+WRITER_WORKERS = 2
+WRITER_QUEUE_SIZE = 32
+# what submit does when the queue is full:
+# block - wait for a free slot, the simulation slows down to the disk speed and no image is lost
+# drop-oldest - discard the oldest queued image to make room for the new one
+# drop-newest - discard the new image
+WRITER_POLICIES = ('block', 'drop-oldest', 'drop-newest')
+
+
+# the depth decoders of the encoder threads, one per thread and frame size
+_depth_decoders = threading.local()
+
+
+def encode_image(path, buffer, height, width):
+    # carla images are BGRA, which is what cv2 expects for a 4 channel png, same pixels as image.save_to_disk.
+    # encoding and writing are timed apart, returns {'encode': seconds, 'write': seconds}
+    t_start = time.perf_counter()
+    array = np.frombuffer(buffer, dtype=np.uint8).reshape((height, width, 4))
+    return write_png(path, array, t_start)
+
+
+def encode_depth(path, buffer, height, width):
+    # a BGRA carla depth image decoded to uint16 centimeters and written as a 16 bit grayscale png, the decoding
+    # counts as encode time
+    t_start = time.perf_counter()
+    decoders = getattr(_depth_decoders, 'decoders', None)
+    if decoders is None:
+        decoders = _depth_decoders.decoders = {}
+    if (height, width) not in decoders:
+        decoders[(height, width)] = DepthDecoder(height, width, 'cm16')
+    return write_png(path, decoders[(height, width)].decode(buffer), t_start)
+
+
+def write_png(path, array, t_start):
+    encoded, png = cv2.imencode('.png', array)
+    if not encoded:
+        raise IOError("Could not encode %s" % path)
+    t_encoded = time.perf_counter()
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    with open(path, 'wb') as png_file:
+        png_file.write(png)
+    return {'encode': t_encoded - t_start, 'write': time.perf_counter() - t_encoded}
+
+
+# the frame ring of a writer pool process, attached once when the process starts
+_worker_ring = None
+
+
+def attach_ring(ring):
+    global _worker_ring
+    _worker_ring = ring
+
+
+def write_slot(sink, path, slot, height, width):
+    # runs in a pool process, the sink reads the frame in place from its shared memory slot
+    return sink(path, _worker_ring.view(slot, (height * width * 4,)), height, width)
+
+
+class ImageWriter:
+    def __init__(self, workers=WRITER_WORKERS, queue_size=WRITER_QUEUE_SIZE, policy='block', use_processes=False,
+                 sink=encode_image, metrics=None, slot_size=None):
+        if policy not in WRITER_POLICIES:
+            raise ValueError("Unknown writer policy %s" % policy)
+
+        self.policy = policy
+        # sink(path, buffer, height, width) writes one image, encode_image or an EpisodeStore.write. It may return
+        # its stage timings as {'encode': seconds, 'write': seconds}, otherwise the whole call counts as write
+        self.sink = sink
+        # PipelineMetrics that gets the per-sensor timings, queue depths and drops of the images with a sensor
+        self.metrics = metrics
+        self.pending = {}
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        # encoding runs in processes when the threads alone are limited by the GIL, each thread then only
+        # hands its image to the pool and waits for it. The images go through a shared memory ring of slot_size
+        # byte slots (the largest frame of the rig), one slot per queued or encoding image
+        self.ring = None
+        self.pool = None
+        if use_processes:
+            if not slot_size:
+                raise ValueError("The process writer needs the slot size of its frame ring")
+            self.ring = FrameRing(queue_size + workers, slot_size)
+            self.pool = ProcessPoolExecutor(max_workers=workers, initializer=attach_ring, initargs=(self.ring,))
+
+        self.submitted = 0
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+        self.max_depth = 0
+        self.encode_time = 0.0
+        self.max_encode_time = 0.0
+
+        self.threads = [threading.Thread(target=self.work, name='image-writer-%d' % i, daemon=True)
+                        for i in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, path, buffer, height, width, sensor=None, owner=None, encoder=None):
+        """Queue one BGRA image for writing, called from the sensor callback.
+
+        encoder replaces encode_image for this image, like encode_depth for a depth sensor. A writer with another
+        sink, like the episode store, ignores it and keeps the raw image.
+
+        buffer is kept as it is, not copied. image.raw_data does not keep its carla.Image alive, and once the
+        image is released carla reuses the memory for the next frames, so pass the image as owner: the queue
+        holds it until its buffer is written. With processes the buffer is copied once into a slot of the frame
+        ring instead and the owner is not kept. Returns False when the policy dropped the new image, or when it
+        could not be copied into the ring, which counts as an error.
+        """
+        with self.lock:
+            self.submitted += 1
+            self.pending[sensor] = self.pending.get(sensor, 0) + 1
+
+        if self.ring is not None:
+            slot = self.acquire_slot()
+            if slot is None:
+                self.count_drop((path, None, height, width, sensor, None, None))
+                return False
+            try:
+                self.ring.write(slot, buffer)
+            except Exception as error:
+                # a frame larger than the slots of a mis-sized rig, the slot and the pending count are given back
+                # or a few such frames would leave the block policy waiting forever
+                self.ring.release(slot)
+                with self.lock:
+                    self.pending[sensor] -= 1
+                    self.errors += 1
+                print('image writer: %s, %s dropped' % (error, path))
+                return False
+            buffer = slot
+            owner = None
+        sink = encoder if encoder is not None and self.sink is encode_image else self.sink
+        item = (path, buffer, height, width, sensor, owner, sink)
+
+        if self.policy == 'block':
+            self.queue.put(item)
+        elif self.policy == 'drop-newest':
+            try:
+                self.queue.put_nowait(item)
+            except queue.Full:
+                self.count_drop(item)
+                return False
+        else:
+            while True:
+                try:
+                    self.queue.put_nowait(item)
+                    break
+                except queue.Full:
+                    try:
+                        self.count_drop(self.queue.get_nowait())
+                        self.queue.task_done()
+                    except queue.Empty:
+                        pass
+
+        with self.lock:
+            self.max_depth = max(self.max_depth, self.queue.qsize())
+            depth = self.pending[sensor]
+        if self.metrics is not None and sensor is not None:
+            self.metrics.queued(sensor, depth)
+        return True
+
+    def acquire_slot(self):
+        # a free ring slot under the queue policy, None when the new image is dropped
+        if self.policy == 'block':
+            return self.ring.acquire()
+        slot = self.ring.acquire(0)
+        while slot is None and self.policy == 'drop-oldest':
+            try:
+                self.count_drop(self.queue.get_nowait())
+                self.queue.task_done()
+            except queue.Empty:
+                # every slot is being encoded right now, one is free as soon as an encoder is done
+                pass
+            slot = self.ring.acquire(0.01)
+        return slot
+
+    def count_drop(self, item):
+        sensor = item[4]
+        with self.lock:
+            self.dropped += 1
+            self.pending[sensor] -= 1
+        if self.ring is not None and item[1] is not None:
+            self.ring.release(item[1])
+        if self.metrics is not None and sensor is not None:
+            self.metrics.drop(sensor)
+
+    def work(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                return
+
+            # the owner stays referenced by item until the buffer is written
+            path, buffer, height, width, sensor, _, sink = item
+            t_start = time.perf_counter()
+            try:
+                if self.pool is not None:
+                    try:
+                        timings = self.pool.submit(write_slot, sink, path, buffer, height, width).result()
+                    finally:
+                        self.ring.release(buffer)
+                else:
+                    timings = sink(path, buffer, height, width)
+                failed = False
+            except Exception as error:
+                print('image writer: %s' % error)
+                failed = True
+            t_encode = time.perf_counter() - t_start
+
+            with self.lock:
+                self.pending[sensor] -= 1
+                depth = self.pending[sensor]
+                if failed:
+                    self.errors += 1
+                else:
+                    self.written += 1
+                    self.encode_time += t_encode
+                    self.max_encode_time = max(self.max_encode_time, t_encode)
+            if self.metrics is not None and sensor is not None:
+                self.metrics.queued(sensor, depth)
+                if not failed:
+                    for stage, seconds in (timings or {'write': t_encode}).items():
+                        self.metrics.observe(sensor, stage, seconds)
+            self.queue.task_done()
+
+    def load(self):
+        # how full the queue is, 1.0 when submit would block or drop
+        return self.queue.qsize() / max(self.queue.maxsize, 1)
+
+    def flush(self):
+        # wait until every queued image is written
+        self.queue.join()
+
+    def close(self):
+        self.flush()
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.ring.close()
+
+    def stats(self):
+        with self.lock:
+            return {'queue_depth': self.queue.qsize(),
+                    'max_queue_depth': self.max_depth,
+                    'submitted': self.submitted,
+                    'written': self.written,
+                    'dropped': self.dropped,
+                    'errors': self.errors,
+                    'mean_encode_ms': 1000 * self.encode_time / max(self.written, 1),
+                    'max_encode_ms': 1000 * self.max_encode_time}
+
+    def __str__(self):
+        return ('image writer: %(written)d written, %(dropped)d dropped, %(errors)d errors, queue %(queue_depth)d '
+                '(max %(max_queue_depth)d), encode %(mean_encode_ms).1f ms mean / %(max_encode_ms).1f ms max'
+                % self.stats())
@@ -0,0 +1,244 @@
+## The following code is a part of Sensors section at the Carla simulator research blog - https://carlasimblog.wordpress.com/2023/09/16/visualize-multiple-sensors/.
+## Feel free to show your support via requested, suggestions and interesting ideas for future research material.
+
+## Per-sensor pipeline metrics: how long every stage of a sensor image takes, from the tick that produced it to the
+## file on disk. The sensor callbacks and the image writer report their timings here, every few seconds p50/p95/p99
+## of each stage are appended to a csv or json-lines file and optionally exported as a Prometheus text file, so the
+## stage that limits the throughput of a node can be read off directly.
+
+import collections
+import csv
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+METRICS_INTERVAL = 5.0
+# latency - wall clock from the world tick of a frame to its sensor callback
+# convert - image.convert calls in the callback
+# callback - the whole sensor callback, the time the sensor thread is busy with an image
+# encode - png encoding on the writer
+# write - writing the encoded file (or appending the raw frame to an episode store)
+STAGES = ('latency', 'convert', 'callback', 'encode', 'write')
+PERCENTILES = (50, 95, 99)
+# samples kept per stage and summary interval, and ticks remembered for the latency of late callbacks
+HISTOGRAM_WINDOW = 10000
+TICK_HISTORY = 1000
+# weight of the newest sample in the running latency average
+LATENCY_SMOOTHING = 0.1
+
+
+class Histogram:
+    def __init__(self, window=HISTOGRAM_WINDOW):
+        # samples of the current interval for the percentiles, count and sum since the start
+        self.samples = collections.deque(maxlen=window)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.samples.append(seconds)
+        self.count += 1
+        self.sum += seconds
+
+    def percentiles(self):
+        if not self.samples:
+            return {p: None for p in PERCENTILES}
+        return dict(zip(PERCENTILES, np.percentile(np.fromiter(self.samples, dtype=np.float64), PERCENTILES)))
+
+    def reset(self):
+        self.samples.clear()
+
+
+class SensorMetrics:
+    def __init__(self):
+        self.stages = {stage: Histogram() for stage in STAGES}
+        self.frames = 0
+        self.skipped = 0
+        self.dropped = 0
+        self.last_frame = None
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+
+
+class PipelineMetrics:
+    def __init__(self, path=None, interval=METRICS_INTERVAL, prometheus=None, clock=time.perf_counter):
+        """path is the summary file, json lines when it ends with .jsonl or .json and csv otherwise.
+
+        prometheus is a text file for the node exporter textfile collector, rewritten with every summary.
+        clock must be the clock of the timestamps given to tick() and arrived(), CustomTimer uses perf_counter.
+        """
+        self.path = path
+        self.interval = interval
+        self.prometheus = prometheus
+        self.clock = clock
+        self.sensors = {}
+        self.ticks = {}
+        self.early = {}
+        # running average of the tick-to-callback latency of all sensors, for the tick scheduler
+        self.recent_latency = 0.0
+        self.lock = threading.Lock()
+        self.last_report = clock()
+
+        self.summary_file = None
+        self.summary = None
+        if path:
+            folder = os.path.dirname(path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            self.summary_file = open(path, 'w', newline='')
+            if not path.endswith(('.jsonl', '.json')):
+                self.summary = csv.DictWriter(self.summary_file, summary_fields())
+                self.summary.writeheader()
+
+    def sensor(self, sensor):
+        # sensors are added the first time they report anything
+        if sensor not in self.sensors:
+            self.sensors[sensor] = SensorMetrics()
+        return self.sensors[sensor]
+
+    def tick(self, frame, t_tick):
+        """The world tick of frame was started at t_tick, called from the simulation loop."""
+        with self.lock:
+            self.ticks[frame] = t_tick
+            # callbacks can run before world.tick() returns, their latency is known only now
+            for sensor, t_arrival in self.early.pop(frame, []):
+                self.observe_latency(sensor, t_arrival - t_tick)
+            for old in [f for f in self.ticks if f <= frame - TICK_HISTORY]:
+                del self.ticks[old]
+            for old in [f for f in self.early if f <= frame - TICK_HISTORY]:
+                del self.early[old]
+
+    def arrived(self, sensor, frame, t_arrival):
+        """A sensor callback started at t_arrival for frame, frames the sensor jumped over count as skipped."""
+        with self.lock:
+            metrics = self.sensor(sensor)
+            metrics.frames += 1
+            if metrics.last_frame is not None and frame > metrics.last_frame + 1:
+                metrics.skipped += frame - metrics.last_frame - 1
+            metrics.last_frame = frame
+            if frame in self.ticks:
+                self.observe_latency(sensor, t_arrival - self.ticks[frame])
+            else:
+                self.early.setdefault(frame, []).append((sensor, t_arrival))
+
+    def observe_latency(self, sensor, seconds):
+        self.sensor(sensor).stages['latency'].observe(seconds)
+        self.recent_latency += LATENCY_SMOOTHING * (seconds - self.recent_latency)
+
+    def observe(self, sensor, stage, seconds):
+        with self.lock:
+            self.sensor(sensor).stages[stage].observe(seconds)
+
+    def queued(self, sensor, depth):
+        # images of the sensor waiting in the writer queue
+        with self.lock:
+            metrics = self.sensor(sensor)
+            metrics.queue_depth = depth
+            metrics.max_queue_depth = max(metrics.max_queue_depth, depth)
+
+    def drop(self, sensor):
+        with self.lock:
+            self.sensor(sensor).dropped += 1
+
+    def rows(self):
+        # one summary row per sensor with the percentiles of the current interval in milliseconds
+        now = time.time()
+        rows = []
+        for name, metrics in sorted(self.sensors.items()):
+            row = {'time': round(now, 3), 'sensor': name, 'frames': metrics.frames, 'skipped': metrics.skipped,
+                   'dropped': metrics.dropped, 'queue_depth': metrics.queue_depth,
+                   'max_queue_depth': metrics.max_queue_depth}
+            for stage, histogram in metrics.stages.items():
+                row['%s_count' % stage] = histogram.count
+                row['%s_sum_s' % stage] = round(histogram.sum, 6)
+                row['%s_mean_ms' % stage] = round(1000 * histogram.sum / max(histogram.count, 1), 3)
+                # empty in an interval without samples of the stage
+                for p, value in histogram.percentiles().items():
+                    row['%s_p%d_ms' % (stage, p)] = None if value is None else round(1000 * float(value), 3)
+            rows.append(row)
+        return rows
+
+    def report(self, force=False):
+        """Write a summary when the interval has passed, called from the simulation loop every tick."""
+        now = self.clock()
+        if not force and now - self.last_report < self.interval:
+            return
+        with self.lock:
+            self.last_report = now
+            rows = self.rows()
+            if self.summary_file is not None:
+                for row in rows:
+                    if self.summary is not None:
+                        self.summary.writerow(row)
+                    else:
+                        self.summary_file.write(json.dumps(row) + '\n')
+                self.summary_file.flush()
+            if self.prometheus:
+                write_prometheus(self.prometheus, rows)
+            for metrics in self.sensors.values():
+                for histogram in metrics.stages.values():
+                    histogram.reset()
+                metrics.max_queue_depth = metrics.queue_depth
+        return rows
+
+    def close(self):
+        rows = self.report(force=True)
+        if self.summary_file is not None:
+            self.summary_file.close()
+            self.summary_file = None
+        return rows
+
+    def __str__(self):
+        # mean per stage since the start, the slowest stage of every sensor is marked
+        with self.lock:
+            lines = ['pipeline metrics, mean ms per frame:']
+            for name, metrics in sorted(self.sensors.items()):
+                means = {stage: 1000 * histogram.sum / histogram.count
+                         for stage, histogram in metrics.stages.items() if histogram.count}
+                # latency is waiting, not work, the limiting stage is the slowest of the others
+                work = {stage: mean for stage, mean in means.items() if stage not in ('latency', 'callback')}
+                slowest = max(work, key=work.get) if work else None
+                lines.append('  %s: %d frames, %d skipped, %d dropped, %s' % (
+                    name, metrics.frames, metrics.skipped, metrics.dropped,
+                    ', '.join('%s %.2f%s' % (stage, mean, ' *' if stage == slowest else '')
+                              for stage, mean in means.items())))
+            return '\n'.join(lines)
+
+
+def summary_fields():
+    fields = ['time', 'sensor', 'frames', 'skipped', 'dropped', 'queue_depth', 'max_queue_depth']
+    for stage in STAGES:
+        fields += ['%s_count' % stage, '%s_sum_s' % stage, '%s_mean_ms' % stage] + ['%s_p%d_ms' % (stage, p) for p in PERCENTILES]
+    return fields
+
+
+def write_prometheus(path, rows):
+    # the textfile collector may read at any moment, the file is written next to it and renamed
+    lines = ['# TYPE carla_sensor_frames_total counter',
+             '# TYPE carla_sensor_skipped_total counter',
+             '# TYPE carla_sensor_dropped_total counter',
+             '# TYPE carla_sensor_queue_depth gauge',
+             '# TYPE carla_sensor_stage_seconds summary']
+    for row in rows:
+        sensor = 'sensor="%s"' % row['sensor']
+        lines.append('carla_sensor_frames_total{%s} %d' % (sensor, row['frames']))
+        lines.append('carla_sensor_skipped_total{%s} %d' % (sensor, row['skipped']))
+        lines.append('carla_sensor_dropped_total{%s} %d' % (sensor, row['dropped']))
+        lines.append('carla_sensor_queue_depth{%s} %d' % (sensor, row['queue_depth']))
+        for stage in STAGES:
+            labels = '%s,stage="%s"' % (sensor, stage)
+            for p in PERCENTILES:
+                value = row['%s_p%d_ms' % (stage, p)]
+                lines.append('carla_sensor_stage_seconds{%s,quantile="%s"} %s' % (
+                    labels, p / 100, 'NaN' if value is None else repr(value / 1000)))
+            lines.append('carla_sensor_stage_seconds_sum{%s} %r' % (labels, row['%s_sum_s' % stage]))
+            lines.append('carla_sensor_stage_seconds_count{%s} %d' % (labels, row['%s_count' % stage]))
+
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    with open(path + '.tmp', 'w') as prometheus_file:
+        prometheus_file.write('\n'.join(lines) + '\n')
+    os.replace(path + '.tmp', path)
@@ -7,20 +7,23 @@ import carla
 import time
 import argparse
 import random
-import queue
 
+from sensor_synchronizer import SYNC_TIMEOUT, SensorSynchronizer
+from tick_scheduler import MAX_CAPTURE_EVERY, MAX_TICK_DELAY, TickScheduler, queue_probe
 
-IND = 0
+## frames the synchronizer may hold before --pace slows the ticks down
+MAX_BACKLOG = 8
 
 
+## files are named by the simulator frame id, images of the same tick always share it
 def process_image_rgb(image):
-    image.save_to_disk(fr'data\test\rgb\{IND}_rgb.png')
+    image.save_to_disk(fr'data\test\rgb\{image.frame}_rgb.png')
 
 def process_image_semantic(image):
-    image.save_to_disk(fr'data\test\semantic\{IND}_semantic.png')
+    image.save_to_disk(fr'data\test\semantic\{image.frame}_semantic.png')
 
 def process_image_depth(image):
-    image.save_to_disk(fr'data\test\depth\{IND}_depth.png')
+    image.save_to_disk(fr'data\test\depth\{image.frame}_depth.png')
 
 if __name__ == '__main__':
 
@@ -48,6 +51,30 @@ if __name__ == '__main__':
         action='store_true',
         help='Asynchronous mode execution')
     argparser.set_defaults(sync=False)
+    argparser.add_argument(
+        '--timeout',
+        default=SYNC_TIMEOUT,
+        type=float,
+        help='seconds a frame waits for its missing sensors before it is dropped (default: %.1f)' % SYNC_TIMEOUT)
+    argparser.add_argument(
+        '--pace',
+        action='store_true',
+        help='delay the ticks, or skip frames, while the saved bundles fall behind the ticks')
+    argparser.add_argument(
+        '--max-backlog',
+        default=MAX_BACKLOG,
+        type=int,
+        help='images and incomplete frames in the synchronizer that count as full (default: %d)' % MAX_BACKLOG)
+    argparser.add_argument(
+        '--max-tick-delay',
+        default=MAX_TICK_DELAY,
+        type=float,
+        help='longest delay of a tick in seconds before frames are skipped (default: %.1f)' % MAX_TICK_DELAY)
+    argparser.add_argument(
+        '--max-capture-every',
+        default=MAX_CAPTURE_EVERY,
+        type=int,
+        help='lowest capture rate of --pace, only every n-th frame saved (default: %d)' % MAX_CAPTURE_EVERY)
 
     args = argparser.parse_args()
 
@@ -75,9 +102,8 @@ if __name__ == '__main__':
     random_location = random.choice(world.get_map().get_spawn_points())
     spawn_point = carla.Transform(carla.Location(x=0, y=0, z=0), carla.Rotation(pitch=0, yaw=0, roll=0))
     vehicle = world.spawn_actor(vehicle_blueprint, spawn_point)
-    rgb_queue = queue.Queue()
-    semantic_queue = queue.Queue()
-    depth_queue = queue.Queue()
+    ## one synchronizer instead of a queue per sensor, images are matched on their frame id
+    synchronizer = SensorSynchronizer(['rgb', 'semantic', 'depth'], timeout=args.timeout)
     vehicle.apply_control(carla.VehicleControl(throttle=target_velocity, steer=0))
 
     camera_bp_rgb = world.get_blueprint_library().find('sensor.camera.rgb')
@@ -102,17 +128,34 @@ if __name__ == '__main__':
     camera_transform_depth = carla.Transform(carla.Location(x=0, y=0.0, z=1.6), carla.Rotation(pitch=0, yaw=0, roll=0))
     camera_depth = world.spawn_actor(camera_bp_depth, camera_transform_depth, attach_to=vehicle)
 
-    camera_rgb.listen(rgb_queue.put)
-    camera_depth.listen(depth_queue.put)
-    camera_semantic.listen(semantic_queue.put)
-
-    while True:
-        world.tick()
-        image_rgb = rgb_queue.get()
-        process_image_rgb(image_rgb)
-        image_depth = depth_queue.get()
-        process_image_depth(image_depth)
-        image_semantic = semantic_queue.get()
-        process_image_semantic(image_semantic)
-
-        IND += 1
+    camera_rgb.listen(synchronizer.callback('rgb'))
+    camera_depth.listen(synchronizer.callback('depth'))
+    camera_semantic.listen(synchronizer.callback('semantic'))
+
+    ## the bundles are saved in this loop, the ticks are paced by how many images wait in the synchronizer
+    scheduler = None
+    if args.pace:
+        scheduler = TickScheduler({'synchronizer': queue_probe(synchronizer.backlog, args.max_backlog)},
+                                  max_delay=args.max_tick_delay, max_capture_every=args.max_capture_every)
+
+    try:
+        while True:
+            if scheduler:
+                scheduler.before_tick()
+            tick_frame = world.tick()
+            if scheduler:
+                scheduler.after_tick(tick_frame)
+            ## only complete rgb / depth / semantic bundles of the same frame are saved
+            bundle = synchronizer.get(timeout=args.timeout)
+            if bundle is None:
+                continue
+            frame, images = bundle
+            if scheduler and not scheduler.captured(frame):
+                continue
+            process_image_rgb(images['rgb'])
+            process_image_depth(images['depth'])
+            process_image_semantic(images['semantic'])
+    finally:
+        print(synchronizer)
+        if scheduler:
+            print(scheduler)
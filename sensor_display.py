@@ -0,0 +1,229 @@
+## The following code is a part of Sensors section at the Carla simulator research blog - https://carlasimblog.wordpress.com/2023/09/16/visualize-multiple-sensors/.
+## Feel free to show your support via requested, suggestions and interesting ideas for future research material.
+
+## The display and sensor managers shared by the data collection scripts: DisplayManager draws the preview window on
+## its own thread, SensorManager stores the images of one sensor through the image writer and hands them to the
+## preview. pygame is only imported once a preview window is opened, so --headless runs never import it.
+
+import queue
+import threading
+import time
+
+import carla
+import numpy as np
+
+from image_writer import encode_depth
+
+PREVIEW_FPS = 15
+
+pygame = None
+
+
+def import_pygame():
+    global pygame
+    try:
+        import pygame
+    except ImportError:
+        raise RuntimeError('cannot import pygame, make sure pygame package is installed')
+
+
+class CustomTimer:
+    def __init__(self):
+        try:
+            self.timer = time.perf_counter
+        except AttributeError:
+            self.timer = time.time
+
+    def time(self):
+        return self.timer()
+
+
+class DisplayManager:
+    def __init__(self, grid_size, window_size, headless=False, preview_fps=PREVIEW_FPS, preview_decimation=1):
+        self.display = None
+        self.grid_size = grid_size
+        self.window_size = window_size
+        self.sensor_list = []
+
+        # the preview runs on its own thread at most preview_fps times a second, a slow display never holds
+        # back world.tick(), preview_decimation shows every n-th pixel of the sensor images
+        self.preview_fps = preview_fps
+        self.preview_decimation = preview_decimation
+        self.events = queue.Queue()
+        self.stop_preview = threading.Event()
+        self.preview_thread = None
+        if not headless:
+            import_pygame()
+            self.preview_thread = threading.Thread(target=self.preview_loop, name='preview', daemon=True)
+            self.preview_thread.start()
+
+    def preview_loop(self):
+        # pygame is initialized, drawn and polled for events on this thread only
+        pygame.init()
+        pygame.font.init()
+        self.display = pygame.display.set_mode(self.get_preview_size(), pygame.HWSURFACE | pygame.DOUBLEBUF)
+
+        period = 1.0 / self.preview_fps
+        while not self.stop_preview.is_set():
+            t_start = time.perf_counter()
+            for event in pygame.event.get():
+                self.events.put(event)
+            self.render()
+            self.stop_preview.wait(max(0.0, period - (time.perf_counter() - t_start)))
+
+    def get_events(self):
+        # the pygame events the preview thread collected since the last call
+        events = []
+        while not self.events.empty():
+            events.append(self.events.get())
+        return events
+
+    def get_window_size(self):
+        return [int(self.window_size[0]), int(self.window_size[1])]
+
+    def get_display_size(self):
+        return [int(self.window_size[0] / self.grid_size[1]), int(self.window_size[1] / self.grid_size[0])]
+
+    def get_preview_tile_size(self):
+        return [-(-size // self.preview_decimation) for size in self.get_display_size()]
+
+    def get_preview_size(self):
+        tile_size = self.get_preview_tile_size()
+        return [tile_size[0] * self.grid_size[1], tile_size[1] * self.grid_size[0]]
+
+    def get_display_offset(self, gridPos):
+        dis_size = self.get_preview_tile_size()
+        return [int(gridPos[1] * dis_size[0]), int(gridPos[0] * dis_size[1])]
+
+    def add_sensor(self, sensor):
+        self.sensor_list.append(sensor)
+
+    def get_sensor_list(self):
+        return self.sensor_list
+
+    def render(self):
+        if not self.render_enabled():
+            return
+
+        for s in self.sensor_list:
+            s.render()
+
+        pygame.display.flip()
+
+    def destroy(self):
+        if self.preview_thread is not None:
+            self.stop_preview.set()
+            self.preview_thread.join()
+
+        for s in self.sensor_list:
+            s.destroy()
+
+    def render_enabled(self):
+        # false when headless, the sensor callbacks then build no array and no surface
+        return self.display != None
+
+
+class SensorManager:
+    def __init__(self, display_man, sensor, spec, writer=None, metrics=None, scheduler=None):
+        self.surface = None
+        # the callback writes into the surface on the sensor thread while render() blits it on the preview thread
+        self.surface_lock = threading.Lock()
+        # rows and columns of the sensor image shown in the preview tile, for a resolution other than the tile's
+        self.preview_index = None
+        self.writer = writer
+        self.metrics = metrics
+        self.scheduler = scheduler
+        self.display_man = display_man
+        self.display_pos = spec['display_pos']
+        self.name = spec['name']
+        self.codec = spec['codec']
+        # depth-png16 sensors go through the depth decoder before the png encoder, the others are written as they are
+        self.encoder = encode_depth if self.codec == 'depth-png16' else None
+        self.sensor = sensor
+        self.timer = CustomTimer()
+
+        self.time_processing = 0.01
+        self.tics_processing = 0
+
+        self.display_man.add_sensor(self)
+        self.sensor.listen(self.save_sensor_image)
+
+    def get_sensor(self):
+        return self.sensor
+
+    def save_sensor_image(self, image):
+        t_start = self.timer.time()
+        if self.metrics is not None:
+            self.metrics.arrived(self.name, image.frame, t_start)
+
+        image.convert(carla.ColorConverter.Raw)
+        t_convert = self.timer.time() - t_start
+
+        if self.display_man.render_enabled():
+            self.update_surface(image)
+
+        # the frames the tick scheduler skips are only previewed
+        if self.codec != 'none' and (self.scheduler is None or self.scheduler.captured(image.frame)):
+            if self.codec == 'cityscapes-png':
+                t_palette = self.timer.time()
+                image.convert(carla.ColorConverter.CityScapesPalette)
+                t_convert += self.timer.time() - t_palette
+            self.save_image(image, '_out/multiple_sensors/raw/%08d_%s.png' % (image.frame, self.name))
+
+        t_end = self.timer.time()
+        self.time_processing += (t_end - t_start)
+        self.tics_processing += 1
+        if self.metrics is not None:
+            self.metrics.observe(self.name, 'convert', t_convert)
+            self.metrics.observe(self.name, 'callback', t_end - t_start)
+
+    def save_image(self, image, path):
+        # with a writer the callback only queues the raw buffer, the png is encoded on the writer threads.
+        # raw_data is a view of carla's memory, the image is queued with it so the memory is not reused before it is written
+        if self.writer is not None:
+            self.writer.submit(path, image.raw_data, image.height, image.width, sensor=self.name, owner=image,
+                               encoder=self.encoder)
+        else:
+            t_start = self.timer.time()
+            if self.encoder is not None:
+                self.encoder(path, image.raw_data, image.height, image.width)
+            else:
+                image.save_to_disk(path)
+            if self.metrics is not None:
+                self.metrics.observe(self.name, 'write', self.timer.time() - t_start)
+
+    def preview_array(self, image):
+        # the sensor image at the size of its preview tile, every n-th pixel when the sensor has the tile resolution
+        # and the nearest pixels otherwise, so a sensor with its own resolution in the rig still fills its tile
+        array = np.frombuffer(image.raw_data, dtype=np.uint32).reshape((image.height, image.width))
+        if [image.width, image.height] == self.display_man.get_display_size():
+            step = self.display_man.preview_decimation
+            return array[::step, ::step]
+
+        if self.preview_index is None or self.preview_index[0] != array.shape:
+            tile_width, tile_height = self.display_man.get_preview_tile_size()
+            rows = np.arange(tile_height) * image.height // tile_height
+            columns = np.arange(tile_width) * image.width // tile_width
+            self.preview_index = (array.shape, rows[:, None], columns)
+        return array[self.preview_index[1], self.preview_index[2]]
+
+    def update_surface(self, image):
+        # a 32 bit XRGB surface has the BGRA memory layout of carla images, so the raw buffer is copied in
+        # as it is: no channel reorder, no intermediate array and a new surface only when the resolution changes
+        array = self.preview_array(image)
+        size = (array.shape[1], array.shape[0])
+        with self.surface_lock:
+            if self.surface is None or self.surface.get_size() != size:
+                self.surface = pygame.Surface(size, 0, 32, (0xFF0000, 0xFF00, 0xFF, 0))
+            pixels = pygame.surfarray.pixels2d(self.surface)
+            pixels.T[...] = array
+            del pixels
+
+    def render(self):
+        with self.surface_lock:
+            if self.surface is not None:
+                offset = self.display_man.get_display_offset(self.display_pos)
+                self.display_man.display.blit(self.surface, offset)
+
+    def destroy(self):
+        self.sensor.destroy()
@@ -0,0 +1,104 @@
+## The following code is a part of Sensors section at the Carla simulator research blog - https://carlasimblog.wordpress.com/2023/09/16/visualize-multiple-sensors/.
+## Feel free to show your support via requested, suggestions and interesting ideas for future research material.
+
+## Sensor rigs described in a json file instead of code: sensor type, transform, blueprint attributes, resolution,
+## output codec and preview tile of every sensor. The blueprint library is fetched once per world and the whole rig
+## is spawned with a single client.apply_batch_sync, one server round-trip instead of two per sensor.
+
+import json
+
+import carla
+
+# the sensor type names of SensorManager, kept so older rig descriptions still work
+SENSOR_TYPES = {
+    'RGBCamera': 'sensor.camera.rgb',
+    'DepthCamera': 'sensor.camera.depth',
+    'SemanticCamera': 'sensor.camera.semantic_segmentation',
+    'InstanceCamera': 'sensor.camera.instance_segmentation',
+}
+# png - the raw BGRA image, cityscapes-png - semantic tags drawn with the CityScapes palette,
+# depth-png16 - depth decoded to uint16 centimeters in a grayscale png, none - preview only
+CODECS = ('png', 'cityscapes-png', 'depth-png16', 'none')
+TRANSFORM_KEYS = ('x', 'y', 'z', 'pitch', 'yaw', 'roll')
+
+_blueprint_libraries = {}
+
+
+def load_rig(path):
+    """Sensor specs of a rig file, {"sensors": [{"name", "type", "transform", "attributes", "resolution",
+    "codec", "display_pos"}, ...]}, only name and type are required.
+    """
+    with open(path) as rig_file:
+        sensors = json.load(rig_file)['sensors']
+
+    rig = []
+    names = set()
+    for i, sensor in enumerate(sensors):
+        unknown = set(sensor) - {'name', 'type', 'transform', 'attributes', 'resolution', 'codec', 'display_pos'}
+        if unknown:
+            raise ValueError("Unknown keys %s for sensor %d of %s" % (', '.join(sorted(unknown)), i, path))
+        if sensor['name'] in names:
+            raise ValueError("Sensor name %s is used twice in %s" % (sensor['name'], path))
+        names.add(sensor['name'])
+
+        transform = sensor.get('transform', {})
+        if set(transform) - set(TRANSFORM_KEYS):
+            raise ValueError("Transform keys of %s must be among %s" % (sensor['name'], ', '.join(TRANSFORM_KEYS)))
+        codec = sensor.get('codec', 'png')
+        if codec not in CODECS:
+            raise ValueError("Unknown codec %s of %s" % (codec, sensor['name']))
+
+        rig.append({'name': sensor['name'],
+                    'type': SENSOR_TYPES.get(sensor['type'], sensor['type']),
+                    'transform': {key: float(transform.get(key, 0)) for key in TRANSFORM_KEYS},
+                    'attributes': {key: str(value) for key, value in sensor.get('attributes', {}).items()},
+                    'resolution': sensor.get('resolution'),
+                    'codec': codec,
+                    'display_pos': sensor.get('display_pos', [0, i])})
+    return rig
+
+
+def rig_grid_size(rig):
+    # rows and columns of the preview grid that holds every display_pos of the rig
+    return [max(spec['display_pos'][0] for spec in rig) + 1, max(spec['display_pos'][1] for spec in rig) + 1]
+
+
+def get_blueprint_library(world):
+    # one server round-trip per world, find() on the cached library is local
+    if world.id not in _blueprint_libraries:
+        _blueprint_libraries[world.id] = world.get_blueprint_library()
+    return _blueprint_libraries[world.id]
+
+
+def spawn_rig(client, world, rig, parent, resolution):
+    """Spawn every sensor of the rig attached to parent with one apply_batch_sync, returns the actors in rig order.
+
+    resolution (width, height) is used for the sensors without their own. If any sensor fails to spawn the
+    others are destroyed again and RuntimeError is raised.
+    """
+    library = get_blueprint_library(world)
+    commands = []
+    for spec in rig:
+        blueprint = library.find(spec['type'])
+        width, height = spec['resolution'] or resolution
+        if blueprint.has_attribute('image_size_x'):
+            blueprint.set_attribute('image_size_x', str(width))
+            blueprint.set_attribute('image_size_y', str(height))
+        for key, value in spec['attributes'].items():
+            blueprint.set_attribute(key, value)
+
+        t = spec['transform']
+        transform = carla.Transform(carla.Location(x=t['x'], y=t['y'], z=t['z']),
+                                    carla.Rotation(pitch=t['pitch'], yaw=t['yaw'], roll=t['roll']))
+        commands.append(carla.command.SpawnActor(blueprint, transform, parent.id))
+
+    responses = client.apply_batch_sync(commands, False)
+    errors = ['%s: %s' % (spec['name'], response.error) for spec, response in zip(rig, responses) if response.error]
+    if errors:
+        client.apply_batch_sync([carla.command.DestroyActor(response.actor_id)
+                                 for response in responses if not response.error], False)
+        raise RuntimeError('Could not spawn the rig, %s' % '; '.join(errors))
+
+    actor_ids = [response.actor_id for response in responses]
+    actors = {actor.id: actor for actor in world.get_actors(actor_ids)}
+    return [actors[actor_id] for actor_id in actor_ids]
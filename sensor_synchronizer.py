@@ -0,0 +1,151 @@
+## The following code is a part of render off screen via image queues post at the Carla simulator research blog - https://carlasimblog.wordpress.com/2023/10/18/computer-queues-and-their-use-in-carla-simulator-to-render-large-images-without-image-drops/.
+## Feel free to show your support via requested, suggestions and interesting ideas for future research material.
+
+## Multi-sensor synchronizer: every sensor callback puts its images on one shared queue, and the images are matched
+## on image.frame instead of assuming that the n-th image of every queue belongs to the same tick. Only complete
+## bundles (one image of every sensor for the same frame) are handed out, frames a sensor skipped are dropped and
+## counted. Anything with a frame attribute works as an image, so it runs without CARLA as well.
+
+import queue
+import threading
+import time
+
+SYNC_TIMEOUT = 2.0
+
+
+class SensorSynchronizer:
+    def __init__(self, sensors, timeout=SYNC_TIMEOUT, clock=time.monotonic):
+        """sensors are the sensor names, timeout is in seconds, one for all or a dict per sensor.
+
+        A frame waits at most the timeout of the sensors it is missing, counted from its first image.
+        """
+        self.sensors = list(sensors)
+        if isinstance(timeout, dict):
+            self.timeouts = {sensor: timeout.get(sensor, SYNC_TIMEOUT) for sensor in self.sensors}
+        else:
+            self.timeouts = {sensor: timeout for sensor in self.sensors}
+        self.clock = clock
+
+        # one queue for all the sensors, the consumer blocks on it instead of polling a queue per sensor
+        self.inbox = queue.Queue()
+        self.pending = {}
+        self.first_seen = {}
+        self.last_emitted = None
+        # abandoned frames and when they were abandoned, their late images are counted instead of starting a new frame
+        self.abandoned = {}
+        self.lock = threading.Lock()
+
+        self.bundles = 0
+        self.partial = 0
+        self.late = 0
+        self.dropped = {sensor: 0 for sensor in self.sensors}
+
+    def callback(self, sensor):
+        # for sensor.listen(), the callback only puts the image on the shared queue
+        if sensor not in self.timeouts:
+            raise ValueError("Unknown sensor %s" % sensor)
+
+        def put(image):
+            self.inbox.put((sensor, image))
+        return put
+
+    def abandon(self, frame):
+        # a frame that will never be complete, every sensor it is missing counts a drop
+        images = self.pending.pop(frame)
+        del self.first_seen[frame]
+        self.abandoned[frame] = self.clock()
+        self.partial += 1
+        for sensor in self.sensors:
+            if sensor not in images:
+                self.dropped[sensor] += 1
+
+    def add(self, sensor, image):
+        frame = image.frame
+        if (self.last_emitted is not None and frame <= self.last_emitted) or frame in self.abandoned:
+            self.late += 1
+            return
+
+        images = self.pending.setdefault(frame, {})
+        self.first_seen.setdefault(frame, self.clock())
+        images[sensor] = image
+
+        # every sensor delivers its frames in order, an older frame it is still missing was skipped
+        for older in sorted(f for f in self.pending if f < frame and sensor not in self.pending[f]):
+            self.abandon(older)
+
+    def expire(self):
+        # abandons the frames past the timeout of a missing sensor, returns the seconds until the next expiry.
+        # abandoned frames are forgotten after the longest timeout, so a sensor that stopped delivering and never
+        # lets a bundle out does not grow the set without bound
+        now = self.clock()
+        max_timeout = max(self.timeouts.values())
+        self.abandoned = {f: t for f, t in self.abandoned.items() if now - t < max_timeout}
+        next_expiry = None
+        for frame in sorted(self.pending):
+            missing = [sensor for sensor in self.sensors if sensor not in self.pending[frame]]
+            expiry = self.first_seen[frame] + min(self.timeouts[sensor] for sensor in missing)
+            if expiry <= now:
+                self.abandon(frame)
+            elif next_expiry is None or expiry - now < next_expiry:
+                next_expiry = expiry - now
+        return next_expiry
+
+    def pop_complete(self):
+        # the oldest complete bundle, older incomplete frames can no longer complete and are abandoned
+        complete = [frame for frame, images in self.pending.items() if len(images) == len(self.sensors)]
+        if not complete:
+            return None
+
+        frame = min(complete)
+        for older in [f for f in self.pending if f < frame]:
+            self.abandon(older)
+        images = self.pending.pop(frame)
+        del self.first_seen[frame]
+        self.last_emitted = frame
+        self.abandoned = {f: t for f, t in self.abandoned.items() if f > frame}
+        self.bundles += 1
+        return frame, images
+
+    def drain(self):
+        # everything already waiting is taken at once, a single bundle check per batch of images
+        while True:
+            try:
+                sensor, image = self.inbox.get_nowait()
+            except queue.Empty:
+                return
+            self.add(sensor, image)
+
+    def get(self, timeout=None):
+        """Next complete bundle as (frame, {sensor: image}) in frame order, None after timeout seconds."""
+        deadline = None if timeout is None else self.clock() + timeout
+        with self.lock:
+            while True:
+                self.drain()
+                bundle = self.pop_complete()
+                if bundle is not None:
+                    return bundle
+
+                wait = self.expire()
+                if deadline is not None:
+                    remaining = deadline - self.clock()
+                    if remaining <= 0:
+                        return None
+                    wait = remaining if wait is None else min(wait, remaining)
+                try:
+                    sensor, image = self.inbox.get(timeout=wait)
+                except queue.Empty:
+                    continue
+                self.add(sensor, image)
+
+    def backlog(self):
+        # images not taken from the queue yet plus frames still waiting for sensors
+        return self.inbox.qsize() + len(self.pending)
+
+    def stats(self):
+        return {'bundles': self.bundles, 'partial': self.partial, 'late': self.late, 'pending': len(self.pending),
+                'dropped': dict(self.dropped)}
+
+    def __str__(self):
+        return ('synchronizer: %d bundles, %d partial frames dropped, %d late images, dropped per sensor %s'
+                % (self.bundles, self.partial, self.late,
+                   ', '.join('%s %d' % (sensor, count) for sensor, count in self.dropped.items())))
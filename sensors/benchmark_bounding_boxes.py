@@ -0,0 +1,115 @@
+## The following code is a part of Sensors section at the Carla simulator research blog - https://carlasimblog.wordpress.com/2023/09/16/visualize-multiple-sensors/.
+## Feel free to show your support via requested, suggestions and interesting ideas for future research material.
+
+## Benchmark of fill_bb against the former per-tag, per-component version on synthetic busy street frames,
+## time per frame and whether both give the same YOLO boxes. The boxes of the instance camera are timed on the
+## same frames, they differ where objects of the same class touch or are split by an occluder.
+
+import cv2
+import numpy as np
+
+from benchmark_timing import benchmark_parser, parse_resolutions, time_per_frame
+from instance_segmentation_to_bounding_boxes import instance_boxes, yolo_boxes
+from semantic_segmentation_to_bounding_boxes import MAX_DEPTH, MIN_HEIGHT, MIN_WIDTH, fill_bb
+
+RESOLUTIONS = '960x540,1920x1080'
+REPEATS = 5
+# carla semantic tags: road, sidewalk, building, sky, pole, traffic light, traffic sign, vegetation, pedestrian, car
+BACKGROUND_TAGS = (1, 2, 3, 11)
+OBJECT_TAGS = {5: 150, 7: 40, 8: 60, 9: 40, 12: 120, 14: 120}
+# the classes of interest and their YOLO class: pole, traffic light, traffic sign, pedestrian, car
+CLASSES = {5: 0, 7: 1, 8: 2, 12: 3, 14: 4}
+
+
+def legacy_fill_bb(img_semantic, img_depth, ref_dict, annotations_cl, annotations_tags,
+                   min_width=MIN_WIDTH, min_height=MIN_HEIGHT, max_depth=MAX_DEPTH):
+    # the former fill_bb with its attributes as arguments, and the return after the loop over all the tags
+    bb = []
+
+    # Reshape the 3D array to a 2D array where each row represents a unique pixel value
+    semantic_tags = np.unique(img_semantic.reshape(-1, 3), axis=0)
+    for tag in semantic_tags:
+        if ref_dict[tuple(tag)] in annotations_cl:
+            # create a mask for each semantic tag
+            mask = np.all(img_semantic == tag, axis=-1) * 1
+
+            # find groups of connected components
+            num_labels, labels = cv2.connectedComponents(mask.astype('uint8'))
+
+            for label in range(1, num_labels):  # Skip label 0 (background)
+                component_mask = np.where(labels == label, 1, 0)
+                # Find the coordinates of the painted pixels
+                points = cv2.findNonZero(component_mask)
+
+                # Find the bounding rectangle of the points
+                x, y, w, h = cv2.boundingRect(points)
+
+                if w > min_width and h > min_height and img_depth[int((y + h / 2)), int((x + w / 2))] < max_depth:
+
+                    # Calculate the center and size of the bounding box in YOLO format
+                    center_x = (x + w / 2) / img_semantic.shape[1]
+                    center_y = (y + h / 2) / img_semantic.shape[0]
+
+                    width = w / img_semantic.shape[1]
+                    height = h / img_semantic.shape[0]
+
+                    # Append the bounding box to the list
+                    cl = annotations_tags[np.where(np.array(annotations_cl) == ref_dict[tuple(tag)])[0][0]]
+                    bb.append((cl, center_x, center_y, width, height))
+
+    if len(bb) == 0:
+        return 0
+    else:
+        return bb
+
+
+def street_frame(height, width, rng):
+    # sky, buildings, sidewalk and road bands with hundreds of objects of the classes of interest drawn over them,
+    # returns the tags, the depth and the BGRA instance image with an id per object
+    tags = np.empty((height, width), dtype=np.uint8)
+    instances = np.zeros((height, width), dtype=np.uint16)
+    instance = 0
+    for i, tag in enumerate(BACKGROUND_TAGS[::-1]):
+        tags[i * height // 4:(i + 1) * height // 4] = tag
+    for tag, count in OBJECT_TAGS.items():
+        for _ in range(count):
+            w, h = rng.integers(4, width // 12), rng.integers(4, height // 8)
+            x, y = rng.integers(0, width - w), rng.integers(0, height - h)
+            instance += 1
+            if rng.random() < 0.5:
+                tags[y:y + h, x:x + w] = tag
+                instances[y:y + h, x:x + w] = instance
+            else:
+                center, axes = (int(x + w // 2), int(y + h // 2)), (int(w // 2), int(h // 2))
+                cv2.ellipse(tags, center, axes, 0, 0, 360, int(tag), -1)
+                cv2.ellipse(instances, center, axes, 0, 0, 360, instance, -1)
+    depth = rng.uniform(100, 2 * MAX_DEPTH, (height, width)).astype(np.float32)
+    bgra = np.dstack([instances >> 8, instances & 0xFF, tags, np.full_like(tags, 255)]).astype(np.uint8)
+    return tags, depth, bgra
+
+
+if __name__ == '__main__':
+    argparser = benchmark_parser('fill_bb against the former per-tag, per-component version', REPEATS, RESOLUTIONS)
+    args = argparser.parse_args()
+
+    rng = np.random.default_rng(0)
+    # a random colour per tag stands in for the CityScapes palette of the former version
+    palette = {tag: tuple(int(v) for v in rng.integers(0, 256, 3)) for tag in range(256)}
+    ref_dict = {colour: tag for tag, colour in palette.items()}
+    annotations_cl, annotations_tags = list(CLASSES), list(CLASSES.values())
+    colours = np.array([palette[tag] for tag in range(256)], dtype=np.uint8)
+
+    print('%-10s %6s %12s %12s %9s %10s %13s %15s' % ('size', 'boxes', 'legacy ms', 'fill_bb ms', 'speedup',
+                                                      'identical', 'instance ms', 'instance boxes'))
+    for width, height in parse_resolutions(args.resolutions):
+        tags, depth, bgra = street_frame(height, width, rng)
+        img_semantic = colours[tags]
+
+        legacy_ms, legacy = time_per_frame(lambda: legacy_fill_bb(
+            img_semantic, depth, ref_dict, annotations_cl, annotations_tags), max(args.repeats // 5, 1))
+        new_ms, boxes = time_per_frame(lambda: fill_bb(tags, depth, CLASSES), args.repeats)
+        instance_ms, objects = time_per_frame(lambda: yolo_boxes(
+            instance_boxes(bgra, height, width, CLASSES, depth), height, width, CLASSES), args.repeats)
+        print('%-10s %6d %12.1f %12.2f %8.1fx %10s %13.2f %15d' % (
+            '%dx%d' % (width, height), len(boxes), legacy_ms, new_ms, legacy_ms / new_ms, sorted(legacy) == sorted(boxes),
+            instance_ms, len(objects)))
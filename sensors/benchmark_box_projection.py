@@ -0,0 +1,79 @@
+## The following code is a part of Sensors section at the Carla simulator research blog - https://carlasimblog.wordpress.com/2023/09/16/visualize-multiple-sensors/.
+## Feel free to show your support via requested, suggestions and interesting ideas for future research material.
+
+## Benchmark of the batched box projection against projecting the 8 vertices of every actor one at a time, on
+## synthetic poses of NPCs around a camera, time per frame and the largest pixel difference of the vertices.
+
+import numpy as np
+
+from benchmark_timing import benchmark_parser, time_per_frame
+from box_projection import box_vertices, camera_intrinsics, pose_matrices, project_boxes
+
+ACTORS = '50,200,1000'
+REPEATS = 20
+WIDTH = 1920
+HEIGHT = 1080
+FOV = 90
+# the camera on the roof of a car at the origin, looking along x
+CAMERA_POSE = (0.0, 0.0, 2.4, -5.0, 0.0, 0.0)
+
+
+def legacy_project(actor_poses, box_poses, extents, camera_pose, intrinsics):
+    # one vertex at a time, the way the carla bounding box tutorial projects them in the sensor callback
+    world_to_camera = np.linalg.inv(pose_matrices(camera_pose)[0])
+    projected = []
+    for actor_pose, box_pose, extent in zip(actor_poses, box_poses, extents):
+        matrix = pose_matrices(actor_pose)[0] @ pose_matrices(box_pose)[0]
+        vertices = []
+        for x in (-1, 1):
+            for y in (-1, 1):
+                for z in (-1, 1):
+                    point = world_to_camera @ matrix @ np.array([x * extent[0], y * extent[1], z * extent[2], 1])
+                    point = np.array([point[1], -point[2], point[0]])
+                    image_point = intrinsics @ point
+                    vertices.append((image_point[0] / image_point[2], image_point[1] / image_point[2]))
+        projected.append(vertices)
+    return np.array(projected)
+
+
+def synthetic_actors(count, rng):
+    # cars and walkers scattered up to 100 meters around the camera, some of them behind it
+    actor_poses = np.zeros((count, 6))
+    actor_poses[:, 0] = rng.uniform(-60, 100, count)
+    actor_poses[:, 1] = rng.uniform(-40, 40, count)
+    actor_poses[:, 4] = rng.uniform(-180, 180, count)
+    walkers = rng.random(count) < 0.3
+    extents = np.where(walkers[:, None], (0.2, 0.2, 0.9), (2.3, 1.0, 0.8))
+    box_poses = np.zeros((count, 6))
+    box_poses[:, 2] = extents[:, 2]
+    actor_poses[:, 2] = np.where(walkers, 0.1, 0.0)
+    return actor_poses, box_poses, extents
+
+
+if __name__ == '__main__':
+    argparser = benchmark_parser('Batched box projection against projecting one vertex at a time', REPEATS)
+    argparser.add_argument(
+        '--actors',
+        default=ACTORS,
+        help='comma separated numbers of actors (default: %s)' % ACTORS)
+    args = argparser.parse_args()
+
+    rng = np.random.default_rng(0)
+    intrinsics = camera_intrinsics(WIDTH, HEIGHT, FOV)
+    # a flat street 30 meters ahead for the occlusion check
+    depth = np.full((HEIGHT, WIDTH), 30, dtype=np.float32)
+
+    print('%-7s %8s %11s %12s %9s %14s' % ('actors', 'in view', 'legacy ms', 'batched ms', 'speedup', 'max diff px'))
+    for count in [int(v) for v in args.actors.split(',')]:
+        actor_poses, box_poses, extents = synthetic_actors(count, rng)
+
+        legacy_ms, legacy = time_per_frame(lambda: legacy_project(
+            actor_poses, box_poses, extents, CAMERA_POSE, intrinsics), max(args.repeats // 10, 1))
+        batched_ms, boxes = time_per_frame(lambda: project_boxes(
+            box_vertices(actor_poses, box_poses, extents), CAMERA_POSE, intrinsics, depth), args.repeats)
+
+        # the vertices of the boxes fully in front of the camera, the legacy projection is wrong for the others
+        in_front = (boxes['vertex_depth'] > 0).all(axis=1)
+        difference = np.abs(boxes['vertices'][in_front] - legacy[in_front]).max()
+        print('%-7d %8d %11.2f %12.2f %8.1fx %14.2e' % (count, boxes['in_view'].sum(), legacy_ms, batched_ms,
+                                                        legacy_ms / batched_ms, difference))
@@ -0,0 +1,84 @@
+## The following code is a part of Sensors section at the Carla simulator research blog - https://carlasimblog.wordpress.com/2023/09/16/sensors/.
+## Feel free to show your support via requested, suggestions and interesting ideas for future research material.
+
+## Benchmark of the depth decoder against the former float64 process_depth on synthetic BGRA depth frames,
+## time per frame and the largest error against an exact float64 decoding of carla's depth encoding.
+
+import numpy as np
+
+from benchmark_timing import benchmark_parser, parse_resolutions, time_per_frame
+from depth_decoder import DEPTH_LEVELS, DEPTH_RANGE_M, DepthDecoder, UINT16_MAX_CM
+
+RESOLUTIONS = '512x512,1920x1080,3840x2880'
+REPEATS = 10
+
+
+def legacy_process_depth(img):
+    # the former process_depth, on an RGB float array, without its unused self
+    R = img[:, :, 0]
+    G = img[:, :, 1]
+    B = img[:, :, 2]
+
+    normalized = (G + B * 256 + R * 256 * 256) / (256 * 256 - 1)
+    in_centimeters = 100000 * normalized
+
+    # avoiding zero division
+    in_centimeters = np.clip(in_centimeters, 0.1, np.max(in_centimeters))
+
+    return in_centimeters
+
+
+def legacy_from_raw(buffer, height, width):
+    # what a callback had to do to use it: reorder BGRA to RGB and convert to float64
+    bgra = np.frombuffer(buffer, dtype=np.uint8).reshape((height, width, 4))
+    return legacy_process_depth(bgra[:, :, 2::-1].astype(np.float64))
+
+
+def exact_centimeters(buffer, height, width):
+    bgra = np.frombuffer(buffer, dtype=np.uint8).reshape((height, width, 4)).astype(np.float64)
+    return 100 * DEPTH_RANGE_M * (bgra[:, :, 2] + bgra[:, :, 1] * 256 + bgra[:, :, 0] * 65536) / DEPTH_LEVELS
+
+
+def synthetic_depth_frame(height, width, rng):
+    # a ground plane from 2 to 120 meters with a random alpha, encoded like the carla depth camera
+    rows = np.linspace(120, 2, height)[:, None] * np.ones((1, width))
+    levels = np.round(rows / DEPTH_RANGE_M * DEPTH_LEVELS).astype(np.uint32)
+    bgra = np.empty((height, width, 4), dtype=np.uint8)
+    bgra[:, :, 2] = levels & 0xFF
+    bgra[:, :, 1] = (levels >> 8) & 0xFF
+    bgra[:, :, 0] = (levels >> 16) & 0xFF
+    bgra[:, :, 3] = rng.integers(0, 256, (height, width))
+    return bgra.tobytes()
+
+
+if __name__ == '__main__':
+    argparser = benchmark_parser('Depth decoder against the former float64 process_depth', REPEATS, RESOLUTIONS,
+                                 repeats_help='frames decoded per measurement')
+    args = argparser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print('%-10s %-16s %10s %14s' % ('size', 'decoder', 'ms/frame', 'max err cm'))
+    for width, height in parse_resolutions(args.resolutions):
+        resolution = '%dx%d' % (width, height)
+        buffer = synthetic_depth_frame(height, width, rng)
+        exact = exact_centimeters(buffer, height, width)
+        decoders = {unit: DepthDecoder(height, width, unit) for unit in ('cm', 'cm16')}
+        stack = np.frombuffer(buffer * 4, dtype=np.uint8).reshape((4, height, width, 4))
+        batch_out = np.empty((4, height, width), dtype=np.float32)
+
+        cases = [
+            ('legacy float64', lambda: legacy_from_raw(buffer, height, width), legacy_from_raw(buffer, height, width)),
+            ('float32 cm', lambda: decoders['cm'].decode(buffer), decoders['cm'].decode(buffer).copy()),
+            ('uint16 cm', lambda: decoders['cm16'].decode(buffer), decoders['cm16'].decode(buffer).copy()),
+            ('float32 batch/4', lambda: decoders['cm'].decode_batch(stack, batch_out), None),
+        ]
+        for name, function, result in cases:
+            ms, _ = time_per_frame(function, args.repeats, warmup=True)
+            if name.endswith('/4'):
+                ms /= len(stack)
+            if result is None:
+                error = '-'
+            else:
+                reference = np.minimum(exact, UINT16_MAX_CM) if name.startswith('uint16') else exact
+                error = '%.3f' % np.abs(result.astype(np.float64) - reference).max()
+            print('%-10s %-16s %10.2f %14s' % (resolution, name, ms, error))
@@ -0,0 +1,43 @@
+## The following code is a part of Sensors section at the Carla simulator research blog - https://carlasimblog.wordpress.com/2023/09/16/sensors/.
+## Feel free to show your support via requested, suggestions and interesting ideas for future research material.
+
+## Timing and command line helpers shared by the sensors/benchmark_*.py scripts.
+
+import argparse
+import time
+
+
+def time_per_frame(function, repeats, warmup=False):
+    # milliseconds per call of function over repeats calls and the result of the last one, warmup makes one
+    # untimed call first so buffers allocated on the first call are not counted
+    if warmup:
+        function()
+    t_start = time.perf_counter()
+    for _ in range(repeats):
+        result = function()
+    return 1000 * (time.perf_counter() - t_start) / repeats, result
+
+
+def benchmark_parser(description, repeats, resolutions=None, repeats_help='frames per measurement'):
+    """Argument parser with the --repeats option of every benchmark, and --resolutions when resolutions is given.
+
+    Scripts add their own options to it before parse_args().
+    """
+    argparser = argparse.ArgumentParser(
+        description=description)
+    if resolutions is not None:
+        argparser.add_argument(
+            '--resolutions',
+            default=resolutions,
+            help='comma separated WxH frame sizes (default: %s)' % resolutions)
+    argparser.add_argument(
+        '--repeats',
+        default=repeats,
+        type=int,
+        help='%s (default: %d)' % (repeats_help, repeats))
+    return argparser
+
+
+def parse_resolutions(resolutions):
+    # 'WxH,WxH' to a list of (width, height), the order of the --res option of the capture scripts
+    return [tuple(int(v) for v in resolution.split('x')) for resolution in resolutions.split(',')]
@@ -0,0 +1,177 @@
+## The following code is a part of Sensors section at the Carla simulator research blog - https://carlasimblog.wordpress.com/2023/09/16/visualize-multiple-sensors/.
+## Feel free to show your support via requested, suggestions and interesting ideas for future research material.
+
+## 3D and 2D boxes of all the vehicles and walkers of a frame, projected to a camera in a few array operations instead
+## of one Python call per vertex. The intrinsic matrix comes from the fov, image_size_x and image_size_y attributes of
+## the camera and is cached. The poses of the actors are read once into arrays, after that the 8 vertices of every
+## box go to the camera in one batched matrix multiply. Boxes that cross the near plane are clipped on their 12 edges,
+## the boxes out of the view frustum are culled and the 2D boxes are checked for occlusion against the decoded
+## depth frame (meters, like DepthDecoder(unit='m')). Everything below actor_arrays works on plain arrays, so the
+## projection can be run offline on synthetic poses.
+
+import numpy as np
+
+# closest distance in front of the camera that is projected, in meters
+NEAR_PLANE = 0.05
+# depth samples per side of a 2D box for the occlusion check
+OCCLUSION_SAMPLES = 8
+# a depth pixel occludes a box when it is nearer than the nearest vertex of the box by more than this, in meters
+OCCLUSION_MARGIN = 0.5
+ACTOR_FILTERS = ('vehicle.*', 'walker.pedestrian.*')
+# the 8 vertices of a unit box and its 12 edges
+BOX_VERTICES = np.array([[x, y, z] for x in (-1, 1) for y in (-1, 1) for z in (-1, 1)], dtype=np.float64)
+BOX_EDGES = np.array([[i, j] for i in range(8) for j in range(i + 1, 8)
+                      if np.abs(BOX_VERTICES[i] - BOX_VERTICES[j]).sum() == 2])
+
+_intrinsics = {}
+
+
+def camera_intrinsics(width, height, fov):
+    # pinhole matrix of a carla camera, fov is the horizontal field of view in degrees, one per camera setup
+    key = (int(width), int(height), float(fov))
+    if key not in _intrinsics:
+        focal = width / (2 * np.tan(np.radians(fov) / 2))
+        _intrinsics[key] = np.array([[focal, 0, width / 2],
+                                     [0, focal, height / 2],
+                                     [0, 0, 1]])
+    return _intrinsics[key]
+
+
+def sensor_intrinsics(sensor):
+    # from the attributes spawn_rig set on the blueprint, actor attributes are strings
+    attributes = sensor.attributes
+    return camera_intrinsics(int(attributes['image_size_x']), int(attributes['image_size_y']),
+                             float(attributes['fov']))
+
+
+def pose_matrices(poses):
+    """4x4 local to world matrices of (n, 6) poses x, y, z, pitch, yaw, roll (degrees), like carla's get_matrix."""
+    poses = np.asarray(poses, dtype=np.float64).reshape(-1, 6)
+    pitch, yaw, roll = np.radians(poses[:, 3:]).T
+    cp, sp = np.cos(pitch), np.sin(pitch)
+    cy, sy = np.cos(yaw), np.sin(yaw)
+    cr, sr = np.cos(roll), np.sin(roll)
+
+    matrices = np.zeros((len(poses), 4, 4))
+    matrices[:, 0] = np.stack([cp * cy, cy * sp * sr - sy * cr, -cy * sp * cr - sy * sr, poses[:, 0]], axis=-1)
+    matrices[:, 1] = np.stack([sy * cp, sy * sp * sr + cy * cr, -sy * sp * cr + cy * sr, poses[:, 1]], axis=-1)
+    matrices[:, 2] = np.stack([sp, -cp * sr, cp * cr, poses[:, 2]], axis=-1)
+    matrices[:, 3, 3] = 1
+    return matrices
+
+
+def box_vertices(actor_poses, box_poses, extents):
+    """World coordinates (n, 8, 3) of the vertices of n boxes.
+
+    actor_poses are the world poses of the actors, box_poses the poses of their bounding boxes relative to the
+    actor (bounding_box.location and rotation) and extents the half sizes of the boxes, all in carla axes.
+    """
+    matrices = pose_matrices(actor_poses) @ pose_matrices(box_poses)
+    local = BOX_VERTICES * np.asarray(extents, dtype=np.float64).reshape(-1, 1, 3)
+    return local @ matrices[:, :3, :3].transpose(0, 2, 1) + matrices[:, None, :3, 3]
+
+
+def to_camera(points, camera_pose):
+    # world points (..., 3) to camera coordinates (..., 3): right, down and forward, the depth camera's depth
+    world_to_camera = np.linalg.inv(pose_matrices(camera_pose)[0])
+    local = points @ world_to_camera[:3, :3].T + world_to_camera[:3, 3]
+    # carla's x forward, y right, z up
+    return np.stack([local[..., 1], -local[..., 2], local[..., 0]], axis=-1)
+
+
+def project(points, intrinsics):
+    # pixel coordinates (..., 2) of camera points (..., 3) in front of the camera
+    return points[..., :2] / points[..., 2:] * intrinsics[[0, 1], [0, 1]] + intrinsics[:2, 2]
+
+
+def project_boxes(vertices, camera_pose, intrinsics, depth=None, near=NEAR_PLANE):
+    """Project the (n, 8, 3) world vertices of n boxes to a camera at camera_pose with the given intrinsics.
+
+    Returns a dict of arrays with one entry per box: vertices (n, 8, 2) pixel coordinates and vertex_depth (n, 8),
+    valid for the vertices in front of the camera, in_view for the boxes that are in the view frustum, their 2D box
+    x0 y0 x1 y1 clipped to the image, truncation (the share of the unclipped 2D box out of the image) and near,
+    the depth of the nearest vertex. With a depth frame (h, w) in meters also visible, the share of
+    OCCLUSION_SAMPLES x OCCLUSION_SAMPLES samples over the 2D box that nothing nearer than the box hides.
+    """
+    width, height = 2 * intrinsics[0, 2], 2 * intrinsics[1, 2]
+    camera = to_camera(vertices, camera_pose)
+    distance = camera[..., 2]
+    in_front = distance > near
+
+    # the points that bound the part of a box in front of the camera: its vertices in front and where its
+    # edges cross the near plane
+    start, end = camera[:, BOX_EDGES[:, 0]], camera[:, BOX_EDGES[:, 1]]
+    crossing = in_front[:, BOX_EDGES[:, 0]] != in_front[:, BOX_EDGES[:, 1]]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = (near - start[..., 2]) / (end[..., 2] - start[..., 2])
+    clipped = start + np.where(crossing, t, 0)[..., None] * (end - start)
+    points = np.concatenate([camera, clipped], axis=1)
+    valid = np.concatenate([in_front, crossing], axis=1)
+    points[~valid] = (0, 0, 1)
+    pixels = project(points, intrinsics)
+
+    # 2D box of the valid points, then the frustum: some of the box in front and its 2D box over the image
+    low = np.where(valid[..., None], pixels, np.inf).min(axis=1)
+    high = np.where(valid[..., None], pixels, -np.inf).max(axis=1)
+    in_view = valid.any(axis=1) & (low[:, 0] < width) & (low[:, 1] < height) & (high[:, 0] > 0) & (high[:, 1] > 0)
+    with np.errstate(invalid='ignore'):
+        x0, y0 = np.clip(low[:, 0], 0, width), np.clip(low[:, 1], 0, height)
+        x1, y1 = np.clip(high[:, 0], 0, width), np.clip(high[:, 1], 0, height)
+        area = (high[:, 0] - low[:, 0]) * (high[:, 1] - low[:, 1])
+        truncation = np.where(area > 0, 1 - (x1 - x0) * (y1 - y0) / area, 0)
+
+    boxes = {'vertices': pixels[:, :8],
+             'vertex_depth': distance,
+             'in_view': in_view,
+             'x0': x0, 'y0': y0, 'x1': x1, 'y1': y1,
+             'truncation': truncation,
+             'near': np.where(in_front, distance, np.inf).min(axis=1)}
+
+    if depth is not None:
+        # a grid of samples over every 2D box, gathered from the depth frame at once
+        steps = (np.arange(OCCLUSION_SAMPLES) + 0.5) / OCCLUSION_SAMPLES
+        xs = np.where(in_view, x0, 0)[:, None] + np.where(in_view, x1 - x0, 0)[:, None] * steps
+        ys = np.where(in_view, y0, 0)[:, None] + np.where(in_view, y1 - y0, 0)[:, None] * steps
+        xs = np.minimum(xs, depth.shape[1] - 1).astype(np.int64)
+        ys = np.minimum(ys, depth.shape[0] - 1).astype(np.int64)
+        samples = depth[ys[:, :, None], xs[:, None, :]]
+        hidden = samples < boxes['near'][:, None, None] - OCCLUSION_MARGIN
+        boxes['visible'] = np.where(in_view, 1 - hidden.mean(axis=(1, 2)), 0)
+    return boxes
+
+
+def actor_arrays(actors):
+    """ids, world poses, bounding box poses and extents of carla actors, the only per-actor Python loop."""
+    ids, actor_poses, box_poses, extents = [], [], [], []
+    for actor in actors:
+        transform = actor.get_transform()
+        box = actor.bounding_box
+        ids.append(actor.id)
+        actor_poses.append((transform.location.x, transform.location.y, transform.location.z,
+                            transform.rotation.pitch, transform.rotation.yaw, transform.rotation.roll))
+        box_poses.append((box.location.x, box.location.y, box.location.z,
+                          box.rotation.pitch, box.rotation.yaw, box.rotation.roll))
+        extents.append((box.extent.x, box.extent.y, box.extent.z))
+    return (np.array(ids, dtype=np.int64), np.array(actor_poses).reshape(-1, 6), np.array(box_poses).reshape(-1, 6),
+            np.array(extents).reshape(-1, 3))
+
+
+def world_boxes(world, camera, depth=None, exclude=()):
+    """Boxes of all the vehicles and walkers of the world seen by camera, only the ones in the view frustum.
+
+    exclude holds actor ids to leave out, like the vehicle the camera is attached to. Adds id and, in world
+    coordinates, world_vertices (n, 8, 3) to the dict of project_boxes.
+    """
+    actors = world.get_actors()
+    actors = [actor for pattern in ACTOR_FILTERS for actor in actors.filter(pattern) if actor.id not in exclude]
+    ids, actor_poses, box_poses, extents = actor_arrays(actors)
+    vertices = box_vertices(actor_poses, box_poses, extents)
+
+    transform = camera.get_transform()
+    camera_pose = (transform.location.x, transform.location.y, transform.location.z,
+                   transform.rotation.pitch, transform.rotation.yaw, transform.rotation.roll)
+    boxes = project_boxes(vertices, camera_pose, sensor_intrinsics(camera), depth)
+    boxes['id'] = ids
+    boxes['world_vertices'] = vertices
+    in_view = boxes.pop('in_view')
+    return {name: column[in_view] for name, column in boxes.items()}
@@ -0,0 +1,74 @@
+## The following code is a part of Sensors section at the Carla simulator research blog - https://carlasimblog.wordpress.com/2023/09/16/sensors/.
+## Feel free to show your support via requested, suggestions and interesting ideas for future research material.
+
+## Depth decoder that works straight from the BGRA buffer of a carla depth image (image.raw_data).
+## Carla encodes the depth as the 24 bit number R + G * 256 + B * 256 * 256 over a 1000 meters range. Viewed as one
+## little-endian uint32 per pixel a BGRA pixel is B + G << 8 + R << 16 + A << 24, so a byte swap and a shift by 8
+## give the 24 bit depth in one pack step, with no channel slicing and no reorder copy. The buffers are allocated
+## once per decoder, decoding a frame allocates nothing.
+
+import numpy as np
+
+# 2 ** 24 - 1 is 1000 meters
+DEPTH_RANGE_M = 1000
+DEPTH_LEVELS = 256 ** 3 - 1
+# uint16 centimetres end at 65535, 655 meters, farther pixels are clipped
+UINT16_MAX_CM = np.iinfo(np.uint16).max
+UNITS = ('m', 'cm', 'cm16')
+
+
+def depth_pixels(buffer, height, width):
+    # one uint32 per BGRA pixel, a view of the buffer (raw_data, bytes or a (h, w, 4) uint8 array)
+    return np.frombuffer(buffer, dtype=np.uint32).reshape((height, width))
+
+
+class DepthDecoder:
+    def __init__(self, height, width, unit='m'):
+        """Decoder of height x width depth frames.
+
+        unit m and cm give float32 depth, a 24 bit depth is exact in float32. cm16 gives uint16 centimetres,
+        rounded and clipped at 65535.
+        """
+        if unit not in UNITS:
+            raise ValueError("Unknown depth unit %s" % unit)
+        self.shape = (height, width)
+        self.unit = unit
+        self.scale = np.float32(DEPTH_RANGE_M * (1 if unit == 'm' else 100) / DEPTH_LEVELS)
+        self.packed = np.empty(self.shape, dtype=np.uint32)
+        self.depth = np.empty(self.shape, dtype=np.float32)
+        self.output = self.depth if unit != 'cm16' else np.empty(self.shape, dtype=np.uint16)
+
+    def pack(self, buffer):
+        # B G R A bytes -> R + G << 8 + B << 16
+        np.copyto(self.packed, depth_pixels(buffer, *self.shape))
+        self.packed.byteswap(inplace=True)
+        np.right_shift(self.packed, 8, out=self.packed)
+        return self.packed
+
+    def decode(self, buffer, out=None):
+        """Depth of one frame, in out or else in the buffer of the decoder, which the next frame overwrites."""
+        if out is None:
+            out = self.output
+        packed = self.pack(buffer)
+        if self.unit != 'cm16':
+            np.multiply(packed, self.scale, out=out, dtype=np.float32)
+            return out
+
+        np.multiply(packed, self.scale, out=self.depth, dtype=np.float32)
+        np.minimum(self.depth, UINT16_MAX_CM, out=self.depth)
+        np.rint(self.depth, out=self.depth)
+        np.copyto(out, self.depth, casting='unsafe')
+        return out
+
+    def decode_batch(self, frames, out=None):
+        """Depth of a stack of frames, a (n, h, w, 4) uint8 array or a list of buffers, as a (n, h, w) array."""
+        if out is None:
+            out = np.empty((len(frames),) + self.shape, dtype=self.output.dtype)
+        for i, frame in enumerate(frames):
+            self.decode(frame, out[i])
+        return out
+
+
+def decode_depth(buffer, height, width, unit='m'):
+    # a single frame without keeping a decoder around, the result is not reused
+    return DepthDecoder(height, width, unit).decode(buffer)
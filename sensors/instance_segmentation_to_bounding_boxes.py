@@ -0,0 +1,233 @@
+## The following code is a part of Sensors section at the Carla simulator research blog - https://carlasimblog.wordpress.com/2023/09/16/visualize-multiple-sensors/.
+## Feel free to show your support via requested, suggestions and interesting ideas for future research material.
+
+## 2D boxes from the instance segmentation camera: R is the semantic tag of a pixel and G + B * 256 the id of the
+## object it belongs to, so touching cars keep their own box and an occluded car split in two parts still gets
+## one. No connected components: box bounds and pixel counts of every object come out of grouped reductions over the
+## pixels of the classes of interest, the median depths out of a single sort of (object, depth).
+## With stats, every object also gets label quality columns: the visible fraction of its box, depth percentiles over
+## its pixels and the share of its contour that is cut by the image border (truncation) or lies against a nearer
+## object (occlusion), from the 4 neighbours of its pixels. The boxes that are labelled keep their stats in a
+## %08d.npz next to the %08d.txt, one array per column and one row per label line, to filter on without recomputing.
+## Running this file writes YOLO labels for the instance and depth pngs of data_collection.py.
+
+import argparse
+import glob
+import os
+
+import cv2
+import numpy as np
+
+from depth_decoder import DepthDecoder
+
+MIN_WIDTH = 10
+MIN_HEIGHT = 10
+# in the unit of the depth given to the boxes, centimetres for the depth pngs
+MAX_DEPTH = 5000
+# carla semantic tags of the road users and their YOLO class
+CLASSES = {12: 0, 13: 1, 14: 2, 15: 3, 16: 4, 18: 5, 19: 6}
+# depth percentiles of the stats, the median is the depth of the box
+PERCENTILES = (10, 90)
+# a neighbour occludes a pixel when it belongs to another object and is nearer than this share of its depth
+OCCLUDER_RATIO = 0.95
+
+
+def group_reduce(ufunc, labels, values, size, initial):
+    # ufunc of the values of every label, unbuffered in place like np.bincount does for sums
+    result = np.full(size, initial, dtype=values.dtype)
+    ufunc.at(result, labels, values)
+    return result
+
+
+def group_percentile(ordered, starts, counts, q):
+    # the q percentile of every run of the sorted values, linear interpolation like np.percentile
+    position = (counts - 1) * (q / 100)
+    low = np.floor(position).astype(np.int64)
+    high = np.ceil(position).astype(np.int64)
+    fraction = (position - low).astype(np.float32)
+    return ordered[starts + low] * (1 - fraction) + ordered[starts + high] * fraction
+
+
+def instance_pixels(buffer, height, width):
+    # one uint32 per BGRA pixel: B | G << 8 | R << 16 | A << 24, the tag is R and the instance id G + B * 256
+    return np.frombuffer(buffer, dtype=np.uint32).reshape((height, width))
+
+
+def contour_stats(keys, depth, pixels, xs, labels, size, height, width):
+    # contour sides of every object (the 4 neighbours of its pixels that are not its own), the ones on the image
+    # border and the ones against a nearer object, border pixels have no neighbour on that side
+    own = keys[pixels]
+    own_depth = None if depth is None else depth[pixels] * OCCLUDER_RATIO
+    contour = np.zeros(pixels.size, dtype=np.uint8)
+    border = np.zeros(pixels.size, dtype=np.uint8)
+    occluded = np.zeros(pixels.size, dtype=np.uint8)
+    for offset, on_border in ((-1, xs == 0), (1, xs == width - 1),
+                              (-width, pixels < width), (width, pixels >= (height - 1) * width)):
+        neighbours = np.where(on_border, pixels, pixels + offset)
+        other = keys[neighbours] != own
+        contour += other | on_border
+        border += on_border
+        if depth is not None:
+            occluded += other & (depth[neighbours] < own_depth)
+    # the sides of the pixels summed per object
+    contour, border, occluded = (np.bincount(labels, weights=sides, minlength=size)
+                                 for sides in (contour, border, occluded))
+    return contour, border, occluded
+
+
+def instance_boxes(buffer, height, width, classes, depth=None, stats=False):
+    """Every object of the classes of interest in a BGRA instance image (raw_data, bytes or a (h, w, 4) array).
+
+    Returns a dict of arrays with one entry per object, ordered by class and instance id: tag, instance id,
+    inclusive x0 y0 x1 y1, pixel count and, with a depth map of the same size, the median depth of the object.
+    stats adds visible (pixels over box area), truncation and, with a depth map, occlusion (shares of the contour)
+    and the depth_p<q> of PERCENTILES.
+    """
+    tags = sorted(classes)
+    class_index = np.full(256, 255, dtype=np.uint8)
+    class_index[tags] = np.arange(len(tags))
+
+    # the class index of every pixel from its R byte, 255 for the classes that are not of interest
+    pixel_class = cv2.LUT(cv2.extractChannel(np.frombuffer(buffer, dtype=np.uint8).reshape((height, width, 4)), 2),
+                          class_index).ravel()
+    pixels = np.flatnonzero(pixel_class != 255)
+
+    # object = class index << 16 | the G and B bytes, bincount gives the pixel count of every object at once
+    # and a lookup table turns the objects that are there into labels 0..n-1
+    keys = instance_pixels(buffer, height, width).ravel()
+    objects = keys[pixels] & 0xFFFF
+    objects |= pixel_class[pixels].astype(np.uint32) << 16
+    counts = np.bincount(objects, minlength=len(tags) << 16)
+    present = np.flatnonzero(counts)
+    label_of = np.zeros(counts.size, dtype=np.int32)
+    label_of[present] = np.arange(present.size)
+    labels = label_of[objects]
+
+    # the pixels are in raster order, the first and last pixel of an object give its top and bottom rows
+    first = group_reduce(np.minimum, labels, pixels, present.size, height * width)
+    last = group_reduce(np.maximum, labels, pixels, present.size, -1)
+    xs = pixels % width
+    boxes = {'tag': np.array(tags, dtype=np.uint8)[present >> 16],
+             'instance': ((present & 0xFF) << 8 | (present >> 8) & 0xFF).astype(np.uint16),
+             'x0': group_reduce(np.minimum, labels, xs, present.size, width),
+             'y0': first // width,
+             'x1': group_reduce(np.maximum, labels, xs, present.size, -1),
+             'y1': last // width,
+             'pixels': counts[present]}
+
+    if depth is not None:
+        depth = np.ascontiguousarray(depth, dtype=np.float32).ravel()
+        # one sort of (label, depth): positive float32 depths sort like their bit patterns, so both fit a uint64
+        # and the depths of every object end up sorted in its run of the sorted array
+        ordered = np.sort(labels.astype(np.uint64) << 32 | depth[pixels].view(np.uint32))
+        ordered = ordered.astype(np.uint32).view(np.float32)
+        starts = np.cumsum(boxes['pixels']) - boxes['pixels']
+        # same as np.median, the mean of the two middle pixels for an even count
+        boxes['depth'] = (ordered[starts + (boxes['pixels'] - 1) // 2] + ordered[starts + boxes['pixels'] // 2]) / 2
+        if stats:
+            for q in PERCENTILES:
+                boxes['depth_p%d' % q] = group_percentile(ordered, starts, boxes['pixels'], q)
+
+    if stats:
+        # the alpha byte is not part of the object
+        contour, border, occluded = contour_stats(keys & 0xFFFFFF, depth, pixels, xs, labels, present.size,
+                                                  height, width)
+        area = (boxes['x1'] - boxes['x0'] + 1) * (boxes['y1'] - boxes['y0'] + 1)
+        boxes['visible'] = (boxes['pixels'] / area).astype(np.float32)
+        boxes['truncation'] = (border / contour).astype(np.float32)
+        if depth is not None:
+            boxes['occlusion'] = (occluded / contour).astype(np.float32)
+    return boxes
+
+
+def label_mask(boxes, min_width=MIN_WIDTH, min_height=MIN_HEIGHT, max_depth=MAX_DEPTH):
+    # the boxes that become labels, like the filters of fill_bb with the median depth
+    keep = (boxes['x1'] - boxes['x0'] + 1 > min_width) & (boxes['y1'] - boxes['y0'] + 1 > min_height)
+    if 'depth' in boxes:
+        keep &= boxes['depth'] < max_depth
+    return keep
+
+
+def yolo_boxes(boxes, height, width, classes, min_width=MIN_WIDTH, min_height=MIN_HEIGHT, max_depth=MAX_DEPTH):
+    """(class, center x, center y, width, height) of the boxes, like fill_bb, 0 when no box is left."""
+    w = boxes['x1'] - boxes['x0'] + 1
+    h = boxes['y1'] - boxes['y0'] + 1
+    keep = label_mask(boxes, min_width, min_height, max_depth)
+
+    lookup = np.zeros(256, dtype=np.int64)
+    lookup[list(classes)] = list(classes.values())
+    center_x = (boxes['x0'][keep] + w[keep] / 2) / width
+    center_y = (boxes['y0'][keep] + h[keep] / 2) / height
+    bb = list(zip(lookup[boxes['tag'][keep]].tolist(), center_x.tolist(), center_y.tolist(),
+                  (w[keep] / width).tolist(), (h[keep] / height).tolist()))
+
+    if len(bb) == 0:
+        return 0
+    else:
+        return bb
+
+
+def read_stats(label_path):
+    # the stats columns of the lines of a %08d.txt label file, from the %08d.npz next to it
+    with np.load(os.path.splitext(label_path)[0] + '.npz') as sidecar:
+        return dict(sidecar)
+
+
+def write_labels(raw_dir, output_dir, classes=CLASSES, max_depth=MAX_DEPTH, stats=False):
+    # one <frame>.txt per %08d_instance.png, the boxes farther than max_depth need the %08d_depth.png of the frame,
+    # with stats also a <frame>.npz with the stats of the labelled boxes
+    os.makedirs(output_dir, exist_ok=True)
+    decoder = None
+    written = 0
+    for instance_path in sorted(glob.glob(os.path.join(raw_dir, '*_instance.png'))):
+        frame = os.path.basename(instance_path)[:-len('_instance.png')]
+        instance = cv2.imread(instance_path, cv2.IMREAD_UNCHANGED)
+        height, width = instance.shape[:2]
+
+        depth = None
+        depth_path = os.path.join(raw_dir, '%s_depth.png' % frame)
+        if os.path.exists(depth_path):
+            if decoder is None or decoder.shape != (height, width):
+                decoder = DepthDecoder(height, width, 'cm')
+            depth = decoder.decode(cv2.imread(depth_path, cv2.IMREAD_UNCHANGED))
+
+        boxes = instance_boxes(instance, height, width, classes, depth, stats)
+        bb = yolo_boxes(boxes, height, width, classes, max_depth=max_depth)
+        with open(os.path.join(output_dir, '%s.txt' % frame), 'w') as labels:
+            for box in bb or []:
+                labels.write('%d %.6f %.6f %.6f %.6f\n' % box)
+        if stats:
+            keep = label_mask(boxes, max_depth=max_depth)
+            np.savez(os.path.join(output_dir, '%s.npz' % frame), **{name: column[keep]
+                                                                    for name, column in boxes.items()})
+        written += 1
+    return written
+
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(
+        description='YOLO labels from the instance segmentation pngs of data_collection.py')
+    argparser.add_argument(
+        'raw_dir',
+        help='folder with the %%08d_instance.png (and %%08d_depth.png) files')
+    argparser.add_argument(
+        'output_dir',
+        help='where to write the %%08d.txt label files')
+    argparser.add_argument(
+        '--classes',
+        default=','.join('%d:%d' % item for item in CLASSES.items()),
+        help='comma separated tag:class pairs (default: road users)')
+    argparser.add_argument(
+        '--max-depth',
+        default=MAX_DEPTH,
+        type=float,
+        help='farthest median depth of a labelled object in centimetres (default: %d)' % MAX_DEPTH)
+    argparser.add_argument(
+        '--stats',
+        action='store_true',
+        help='also write the visibility, truncation, occlusion and depth stats of the labels to %%08d.npz')
+    args = argparser.parse_args()
+
+    classes = {int(tag): int(cl) for tag, cl in (pair.split(':') for pair in args.classes.split(','))}
+    written = write_labels(args.raw_dir, args.output_dir, classes, args.max_depth, args.stats)
+    print('%d label files written to %s' % (written, args.output_dir))
@@ -3,18 +3,33 @@
 
 ## this is a simple and short code for raw depth conversion to grascale depth at centimeters units.
 ## pay attention that if you use int16 for writing the output depth image you can only use depth up to 65355 centimeters even though the simulator gives you data up to 1000 meters.
-## Carla's repository has this code under the sensors page - https://carla.readthedocs.io/en/latest/ref_sensors/#depth-camera, but has two mistakes which are corrected at this following code snippet
+## Carla's repository has this code under the sensors page - https://carla.readthedocs.io/en/latest/ref_sensors/#depth-camera
+## the decoding works straight on the BGRA raw_data of the depth image, see depth_decoder.py
 
-def process_depth(self, img):
+import threading
 
-    R = img[:, :, 0]
-    G = img[:, :, 1]
-    B = img[:, :, 2]
+import numpy as np
 
-    normalized = (G + B * 256 + R * 256 * 256) / (256 * 256 - 1)
-    in_centimeters = 100000 * normalized
+from depth_decoder import DepthDecoder
+
+# nearest depth in centimeters, the depth is clipped to it for avoiding zero division, uint16 output clips at 1 cm
+MIN_DEPTH_CM = 0.1
+
+# one decoder per callback thread and frame size, its buffers are reused for every frame
+_local = threading.local()
+
+
+def process_depth(image, unit='cm'):
+    decoders = getattr(_local, 'decoders', None)
+    if decoders is None:
+        decoders = _local.decoders = {}
+    key = (image.height, image.width, unit)
+    if key not in decoders:
+        decoders[key] = DepthDecoder(*key)
+    depth = decoders[key].decode(image.raw_data)
 
     # avoiding zero division
-    in_centimeters = np.clip(in_centimeters, 0.1, np.max(in_centimeters))
+    np.maximum(depth, {'m': MIN_DEPTH_CM / 100, 'cm': MIN_DEPTH_CM, 'cm16': 1}[unit], out=depth)
 
-    return in_centimeters
+    # the returned array is overwritten by the next frame of this thread, copy it to keep it
+    return depth
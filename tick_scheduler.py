@@ -0,0 +1,135 @@
+## The following code is a part of render off screen via image queues post at the Carla simulator research blog - https://carlasimblog.wordpress.com/2023/10/18/computer-queues-and-their-use-in-carla-simulator-to-render-large-images-without-image-drops/.
+## Feel free to show your support via requested, suggestions and interesting ideas for future research material.
+
+## Backpressure-aware tick pacing: before every tick the scheduler reads how full the pipeline is (writer queue,
+## synchronizer backlog, tick-to-callback latency). When it fills up the ticks are delayed, and once the delay is at
+## its maximum (or in async mode, where the server cannot be held back) only every n-th frame is captured and the
+## others are counted as skipped. With headroom the capture rate and then the tick rate go back up, so the run
+## settles at the highest rate the disk and the encoders sustain without the queues growing without bound.
+
+import time
+
+HIGH_WATER = 0.75
+LOW_WATER = 0.25
+MIN_TICK_DELAY = 0.005
+MAX_TICK_DELAY = 0.5
+MAX_CAPTURE_EVERY = 16
+# tick-to-callback latency that counts as a full pipeline
+LATENCY_BUDGET = 0.5
+# how often a delayed tick checks whether the pipeline drained
+POLL_INTERVAL = 0.005
+# ticks between two capture rate changes, the queues need a few ticks to show the effect of the last one
+RATE_COOLDOWN = 10
+
+
+def queue_probe(depth, capacity):
+    # load of a queue, depth() items out of capacity
+    return lambda: depth() / max(capacity, 1)
+
+
+class TickScheduler:
+    def __init__(self, probes, sync=True, high_water=HIGH_WATER, low_water=LOW_WATER, max_delay=MAX_TICK_DELAY,
+                 max_capture_every=MAX_CAPTURE_EVERY, clock=time.perf_counter, sleep=time.sleep):
+        """probes is a dict name: callable returning the load of that part of the pipeline, 1.0 is full.
+
+        sync is False for world.wait_for_tick(), the ticks are then never delayed and only the capture rate
+        is lowered.
+        """
+        self.probes = dict(probes)
+        self.sync = sync
+        self.high_water = high_water
+        self.low_water = low_water
+        self.max_delay = max_delay
+        self.max_capture_every = max_capture_every
+        self.clock = clock
+        self.sleep = sleep
+
+        self.delay = 0.0
+        self.capture_every = 1
+        # (first frame, capture_every) of every rate change, callbacks of older frames still use the old rate
+        self.rates = [(0, 1)]
+        self.last_frame = None
+        self.last_rate_change = -RATE_COOLDOWN
+        self.limiting = None
+
+        self.ticks = 0
+        self.captured_frames = 0
+        self.skipped = 0
+        self.delayed = 0
+        self.delay_time = 0.0
+        self.max_load = 0.0
+
+    def load(self):
+        # the fullest part of the pipeline
+        loads = {name: probe() for name, probe in self.probes.items()}
+        if not loads:
+            return 0.0
+        self.limiting = max(loads, key=loads.get)
+        self.max_load = max(self.max_load, loads[self.limiting])
+        return loads[self.limiting]
+
+    def before_tick(self):
+        """Called right before the tick, adapts the rates and waits out the tick delay."""
+        load = self.load()
+        if load >= self.high_water:
+            self.slow_down()
+        elif load <= self.low_water:
+            self.speed_up()
+
+        if self.sync and self.delay > 0:
+            # the delay ends early once the pipeline drained
+            t_start = self.clock()
+            deadline = t_start + self.delay
+            while self.clock() < deadline:
+                self.sleep(min(POLL_INTERVAL, max(deadline - self.clock(), 0)))
+                if self.load() <= self.low_water:
+                    break
+            self.delayed += 1
+            self.delay_time += self.clock() - t_start
+
+    def slow_down(self):
+        if self.sync and self.delay < self.max_delay:
+            self.delay = min(max(2 * self.delay, MIN_TICK_DELAY), self.max_delay)
+        elif self.capture_every < self.max_capture_every and self.ticks - self.last_rate_change >= RATE_COOLDOWN:
+            self.set_capture_every(2 * self.capture_every)
+
+    def speed_up(self):
+        # the capture rate comes back before the tick rate
+        if self.capture_every > 1:
+            if self.ticks - self.last_rate_change >= RATE_COOLDOWN:
+                self.set_capture_every(self.capture_every // 2)
+        elif self.delay > 0:
+            self.delay = self.delay / 2 if self.delay / 2 >= MIN_TICK_DELAY else 0.0
+
+    def set_capture_every(self, capture_every):
+        first = 0 if self.last_frame is None else self.last_frame + 1
+        self.capture_every = capture_every
+        self.last_rate_change = self.ticks
+        self.rates = [rate for rate in self.rates[-3:] if rate[0] < first] + [(first, capture_every)]
+        print('tick scheduler: capturing every %d. frame, %s is full' % (capture_every, self.limiting))
+
+    def after_tick(self, frame):
+        # frame is the id the tick returned
+        self.last_frame = frame
+        self.ticks += 1
+        if self.captured(frame):
+            self.captured_frames += 1
+        else:
+            self.skipped += 1
+
+    def captured(self, frame):
+        """Whether the images of frame are stored, the same frames for every sensor so bundles stay complete."""
+        for first, capture_every in reversed(self.rates):
+            if frame >= first:
+                return frame % capture_every == 0
+        return True
+
+    def stats(self):
+        return {'ticks': self.ticks, 'captured': self.captured_frames, 'skipped': self.skipped,
+                'delayed': self.delayed, 'delay_s': self.delay_time, 'tick_delay_ms': 1000 * self.delay,
+                'capture_every': self.capture_every, 'max_load': self.max_load}
+
+    def __str__(self):
+        return ('tick scheduler: %(ticks)d ticks, %(captured)d captured, %(skipped)d skipped, %(delayed)d delayed '
+                'for %(delay_s).1f s, now %(tick_delay_ms).0f ms delay and every %(capture_every)d. frame captured, '
+                'max load %(max_load).2f' % self.stats())